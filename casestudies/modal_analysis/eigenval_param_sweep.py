@@ -97,31 +97,27 @@ class EigenSweep:
         self.root.mainloop()
 
 
+def set_inertia(ps, value):
+    # Set the parameter value in the power system model
+    ps.gen['GEN'].par['H'] = value
+
+
 def main():
     import casestudies.ps_data.k2a_regulated as model_data
 
-    eigenvalues_list = []
-    participation_factors_list = []
-
     # Define the parameter values to sweep
     parameter_values = np.linspace(3,10,10)  # Example parameter values
 
     model = model_data.load()
     ps = dps.PowerSystemModel(model=model)
     ps.init_dyn_sim()
-    ps_lin = dps_mdl.PowerSystemModelLinearization(ps)
-
-    for param in parameter_values:
-        # Set the parameter value in the power system model
-        ps.gen['GEN'].par['H'] = param
 
-        # Linearize
-        ps_lin.linearize()
-        ps_lin.eigenvalue_decomposition()
+    # Linearize and compute eigenvalues at each parameter value (in parallel), with modes paired between points
+    sweep = dps_mdl.ParameterSweep(model, set_inertia, parameter_values, participation=True)
+    sweep.run()
 
-        eigenvalues_list.append(ps_lin.eigs)
-        pfs_abs = np.abs(ps_lin.lev.T * ps_lin.rev) / np.max(np.abs(ps_lin.lev.T * ps_lin.rev), axis=0)
-        participation_factors_list.append(pfs_abs)
+    eigenvalues_list = list(sweep.eigs)
+    participation_factors_list = [np.nan_to_num(pfs_abs) for pfs_abs in sweep.participation_factors]
 
     plotter = EigenSweep(eigenvalues_list, participation_factors_list, ps.state_desc, parameter_values)
     plotter.run()
@@ -0,0 +1,36 @@
+import src.dynamic as dps
+import src.modal_analysis as dps_mdl
+import numpy as np
+import matplotlib.pyplot as plt
+
+if __name__ == '__main__':
+
+    import casestudies.ps_data.k2a as model_data
+    model = model_data.load()
+    ps = dps.PowerSystemModel(model=model)
+    ps.init_dyn_sim()
+
+    # Perform system linearization
+    ps_lin = dps_mdl.PowerSystemModelLinearization(ps)
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+
+    # Inputs: Auxiliary voltage signal of each generator, outputs: Speed of each generator
+    gen = ps.gen['GEN']
+    ps_lin.linearize_inputs_v4([(('gen', 'GEN'), 'v_aux', name) for name in gen.par['name']])
+    ps_lin.c = np.zeros((gen.n_units, ps_lin.n))
+    ps_lin.c[np.arange(gen.n_units), gen.state_idx_global['speed']] = 1
+
+    # Frequency response from the input of G1 to the speed of each generator
+    freq = np.logspace(-2, 1, 1000)
+    g = ps_lin.frequency_response(2*np.pi*freq)
+
+    fig, ax = plt.subplots(2, sharex=True)
+    for i, name in enumerate(gen.par['name']):
+        ax[0].loglog(freq, abs(g[:, i, 0]), label=name)
+        ax[1].semilogx(freq, np.angle(g[:, i, 0], deg=True))
+    ax[0].set_ylabel('Magnitude')
+    ax[1].set_ylabel('Phase [deg]')
+    ax[1].set_xlabel('Frequency [Hz]')
+    ax[0].legend()
+    plt.show(block=True)
@@ -0,0 +1,41 @@
+import src.dynamic as dps
+import src.modal_analysis as dps_mdl
+import numpy as np
+import matplotlib.pyplot as plt
+
+if __name__ == '__main__':
+
+    import casestudies.ps_data.ieee39 as model_data
+    model = model_data.load()
+    ps = dps.PowerSystemModel(model=model)
+    ps.init_dyn_sim()
+
+    # Perform system linearization
+    ps_lin = dps_mdl.PowerSystemModelLinearization(ps)
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+
+    # Inputs: Auxiliary voltage signal of each generator, outputs: Speed of each generator
+    gen = ps.gen['GEN']
+    ps_lin.linearize_inputs_v4([(('gen', 'GEN'), 'v_aux', name) for name in gen.par['name']])
+    ps_lin.c = np.zeros((gen.n_units, ps_lin.n))
+    ps_lin.c[np.arange(gen.n_units), gen.state_idx_global['speed']] = 1
+
+    # Reduced models
+    mode_idx = ps_lin.get_mode_idx(['em', 'non_conj'], damp_threshold=0.3)
+    reduced = {
+        'Modal truncation': ps_lin.modal_truncation(mode_idx),
+        'Balanced truncation': ps_lin.balanced_truncation(order=20),
+    }
+
+    # Frequency response from the input of the first generator to its speed
+    freq = np.logspace(-2, 1, 1000)
+    fig, ax = plt.subplots(1)
+    ax.loglog(freq, abs(ps_lin.frequency_response(2*np.pi*freq)[:, 0, 0]), label='Full ({} states)'.format(ps_lin.n))
+    for label, ps_red in reduced.items():
+        g = ps_red.frequency_response(2*np.pi*freq)
+        ax.loglog(freq, abs(g[:, 0, 0]), '--', label='{} ({} states)'.format(label, ps_red.n))
+    ax.set_xlabel('Frequency [Hz]')
+    ax.set_ylabel('Magnitude')
+    ax.legend()
+    plt.show(block=True)
@@ -19,6 +19,8 @@ class PIRegulator(DAEModel):
 
 
 class Integrator(DAEModel):
+    batchable = True
+
     def state_list(self):
         return ['x_i']
 
@@ -74,6 +76,8 @@ class Limiter(DAEModel):
 
 
 class Washout(DAEModel):
+    batchable = True
+
     def state_list(self):
         return ['x']
 
@@ -100,6 +104,8 @@ class TimeConstant(DAEModel):
 
 
     '''
+    batchable = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.zero_idx = self.par['T']==0
@@ -172,6 +178,8 @@ class TimeConstantLims(DAEModel):
           V_min
 
     '''
+    batchable = True
+
     def state_list(self):
         return ['x']
 
@@ -237,6 +245,8 @@ class LeadLag(DAEModel):
            |_______________|
      
     '''
+    batchable = True
+
     def state_list(self):
         return ['x']
 
@@ -260,6 +270,8 @@ class LeadLag(DAEModel):
 
 
 class PIRegulator2(DAEModel):
+    batchable = True
+
     def state_list(self):
         return ['x']
 
@@ -295,6 +307,8 @@ class WashoutGain(DAEModel):
     sx = y
     y = 1/T(Ku - x)
     '''
+    batchable = True
+
     def state_list(self):
         return ['x']
 
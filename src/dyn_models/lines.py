@@ -20,9 +20,25 @@ class Line(DAEModel):
         return {'from_bus': self.par['from_bus'], 'to_bus': self.par['to_bus']}
 
     def event(self, ps, line_name, event_name):
+        y_line_red = self.event_admittance(ps, line_name, event_name)
+        if y_line_red is not None:
+            ps.y_bus_red += y_line_red
+
+    def event_admittance(self, ps, line_name, event_name):
+        # Returns the change of the reduced admittance matrix caused by the event (and updates the line status)
         line_idx = lookup_strings(line_name, ps.lines['Line'].par['name'])
+        if not np.isin(line_idx, np.arange(self.n_units)):
+            raise ValueError('Line {} not found, line event failed.'.format(line_name))
 
         if event_name in ['connect', 'disconnect']:
+            idx_from = self.bus_idx_red['from_bus'][line_idx]
+            idx_to = self.bus_idx_red['to_bus'][line_idx]
+
+            # Buses removed by Kron reduction have index -99999
+            buses_in_red_sys = idx_from >= 0 and idx_to >= 0
+            if not buses_in_red_sys:
+                raise ValueError('The buses of line {} are not in the reduced system, line event failed.'.format(
+                    line_name))
 
             if event_name == 'connect':
                 sign = 1
@@ -31,27 +47,19 @@ class Line(DAEModel):
                 sign = -1
                 self.connected[line_idx] = False
 
-            idx_from = self.bus_idx_red['from_bus'][line_idx]
-            idx_to = self.bus_idx_red['to_bus'][line_idx]
-
             admittance = self.admittance[line_idx]
             shunt = self.shunt[line_idx]
 
-            buses_in_red_sys = idx_from in ps.bus_idx_red and idx_to in ps.bus_idx_red
             data = np.array([admittance + shunt/2,
                              admittance + shunt/2,
                              -admittance,
                              -admittance])
 
-            if buses_in_red_sys:
-                rows_red = np.array([idx_from, idx_to, idx_from, idx_to])
-                cols_red = np.array([idx_from, idx_to, idx_to, idx_from])
-                y_line_red = lil_matrix((ps.n_bus_red,) * 2, dtype=complex)
-                y_line_red[rows_red, cols_red] = data
-                ps.y_bus_red += y_line_red*sign
-
-            else:
-                print('Line buses are not in reduced system, line event failed.')
+            rows_red = np.array([idx_from, idx_to, idx_from, idx_to])
+            cols_red = np.array([idx_from, idx_to, idx_to, idx_from])
+            y_line_red = lil_matrix((ps.n_bus_red,) * 2, dtype=complex)
+            y_line_red[rows_red, cols_red] = data
+            return y_line_red*sign
 
     def init_extras(self):
         self.idx_from = self.bus_idx_red['from_bus']
@@ -61,6 +69,9 @@ class Line(DAEModel):
         self.v_to_i = np.zeros((self.n_units, n_bus), dtype=complex)
         self.v_to_i_rev = np.zeros((self.n_units, n_bus), dtype=complex)
         for i in range(self.n_units):
+            if self.idx_from[i] < 0 or self.idx_to[i] < 0:
+                # Bus removed by Kron reduction
+                continue
             self.v_to_i[i, [self.idx_from[i], self.idx_to[i]]] = [self.admittance[i] + self.shunt[i]/2, -self.admittance[i]]
             self.v_to_i_rev[i, [self.idx_to[i], self.idx_from[i]]] = [self.admittance[i] + self.shunt[i]/2, -self.admittance[i]]
     
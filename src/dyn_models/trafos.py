@@ -28,6 +28,9 @@ class Trafo(DAEModel):
         self.v_to_i_rev = np.zeros((n_elements, n_bus), dtype=complex)
         
         for i in range(self.n_units):
+            if self.idx_from[i] < 0 or self.idx_to[i] < 0:
+                # Bus removed by Kron reduction
+                continue
             # This might not be correct for phase shifting transformers (conj in the right place?)
             shunt_from = self.ratio_from_0[i] * np.conj(self.ratio_from_0[i]) * self.admittance[i]
             shunt_to = self.ratio_to_0[i] * np.conj(self.ratio_to_0[i]) * self.admittance[i]
@@ -76,6 +76,179 @@ def determine_connections(dyn_mdls, order_by='input'):
     return mdl_connections
 
 
+class ConnectedInput:
+    """
+    Input of a model which is connected to outputs of other models (replaces the input method of the model).
+    Values are stored in a slice of the flat input buffer of a ConnectionPlan. While the plan is active (i.e. during
+    PowerSystemModel.state_derivatives) the buffer has already been filled, otherwise the sources are evaluated.
+    """
+    def __init__(self, plan, idx, gather):
+        self.plan = plan
+        self.idx = idx
+        self.gather = gather  # List of (source, source_idx, dest_idx)
+
+    def __call__(self, x, v):
+        plan = self.plan
+        values = plan.input_values[self.idx]
+        if plan.active:
+            return values
+
+        if plan.tracing:
+            plan.trace_stack[-1].add(self)
+        for source, source_idx, dest_idx in self.gather:
+            values[dest_idx] = plan.evaluate_source(source, x, v)[source_idx]
+        return values
+
+
+class ConnectionSource:
+    def __init__(self, mdl, output_key, idx):
+        self.mdl = mdl
+        self.output_key = output_key
+        self.idx = idx
+        self.fun = None
+
+
+class ConnectionPlan:
+    """
+    Static gather/scatter plan for the connections between models (output from determine_connections).
+    All connected inputs share one flat input buffer, and all source outputs share one flat output buffer. The sources
+    are grouped in levels (determined by tracing which inputs each source reads), such that evaluate() fills all inputs
+    with one fancy-index operation per level.
+    """
+    def __init__(self, mdl_connections, dyn_mdls_dict):
+        self.active = False
+        self.tracing = False
+        self.trace_stack = []
+        self.levels = None
+
+        self.sources = {}
+        n_outputs = 0
+        n_inputs = 0
+        self.inputs = []
+        input_values = []
+        for mdl, connections in mdl_connections.items():
+            for input_key, conn in connections.items():
+                idx = slice(n_inputs, n_inputs + mdl.n_units)
+                n_inputs += mdl.n_units
+                input_values.append(mdl._input_values[input_key].copy())
+
+                gather = []
+                for c in conn:
+                    source_mdl = dyn_mdls_dict[c['container']][c['mdl']]
+                    key = (source_mdl, c['output'])
+                    if key not in self.sources:
+                        self.sources[key] = ConnectionSource(
+                            source_mdl, c['output'], slice(n_outputs, n_outputs + source_mdl.n_units)
+                        )
+                        n_outputs += source_mdl.n_units
+                    source = self.sources[key]
+                    gather.append((source, c['source_idx'], c['dest_idx']))
+
+                connected_input = ConnectedInput(self, idx, gather)
+                self.inputs.append(connected_input)
+                setattr(mdl, input_key, connected_input)
+
+        self.input_values = np.concatenate(input_values) if len(input_values) > 0 else np.zeros(0)
+        self.output_values = np.zeros(n_outputs)
+
+        # Resolve source functions after connecting inputs, since inputs can also act as sources
+        for source in self.sources.values():
+            source.fun = getattr(source.mdl, source.output_key)
+
+    def evaluate_source(self, source, x, v):
+        if not self.tracing:
+            return source.fun(x, v)
+
+        self.trace_stack.append(set())
+        value = source.fun(x, v)
+        source.reads = self.trace_stack.pop()
+        return value
+
+    def compile(self, x, v):
+        """Determine evaluation levels by tracing which connected inputs are read when evaluating each source."""
+        self.tracing = True
+        with np.errstate(all='ignore'):
+            for source in self.sources.values():
+                self.evaluate_source(source, x, v)
+        self.tracing = False
+
+        level = {}
+
+        def get_level(source, visiting):
+            if source in level:
+                return level[source]
+            if source in visiting:
+                raise RecursionError
+            visiting.add(source)
+            feeding = [s for inp in source.reads for s, _, _ in inp.gather]
+            level[source] = 1 + max([get_level(s, visiting) for s in feeding], default=-1)
+            visiting.remove(source)
+            return level[source]
+
+        try:
+            for source in self.sources.values():
+                get_level(source, set())
+        except RecursionError:
+            print('Algebraic loop in model connections, inputs are evaluated on demand.')
+            self.levels = None
+            return
+
+        n_levels = max(level.values(), default=-1) + 1
+        sources_in_level = [[] for _ in range(n_levels)]
+        src_idx = [[] for _ in range(n_levels)]
+        dst_idx = [[] for _ in range(n_levels)]
+        for source, lvl in level.items():
+            sources_in_level[lvl].append(source)
+        for inp in self.inputs:
+            dest_offset = inp.idx.start
+            for source, source_idx, dest_idx in inp.gather:
+                src_idx[level[source]].append(source.idx.start + np.asarray(source_idx, dtype=int))
+                dst_idx[level[source]].append(dest_offset + np.asarray(dest_idx, dtype=int))
+
+        self.levels = [
+            (sources_in_level[i], np.concatenate(src_idx[i]), np.concatenate(dst_idx[i])) for i in range(n_levels)
+        ]
+
+    def evaluate(self, x, v, trace=None):
+        """Evaluate all sources (in order of level) and fill connected inputs. Inputs are then read from the buffer
+        until deactivate() is called. If a list is given as trace, the evaluation steps are appended to it."""
+        if self.levels is None:
+            return
+
+        self.active = True
+        for sources, src_idx, dst_idx in self.levels:
+            for source in sources:
+                self.output_values[source.idx] = source.fun(x, v)
+                if trace is not None:
+                    trace.append(SourceStep(self, source))
+            self.input_values[dst_idx] = self.output_values[src_idx]
+            if trace is not None:
+                trace.append(ScatterStep(self, src_idx, dst_idx))
+
+    def deactivate(self):
+        self.active = False
+
+
+class SourceStep:
+    def __init__(self, plan, source):
+        self.plan = plan
+        self.fun = source.fun
+        self.idx = source.idx
+
+    def __call__(self, x, v):
+        self.plan.output_values[self.idx] = self.fun(x, v)
+
+
+class ScatterStep:
+    def __init__(self, plan, src_idx, dst_idx):
+        self.plan = plan
+        self.src_idx = src_idx
+        self.dst_idx = dst_idx
+
+    def __call__(self, x, v):
+        self.plan.input_values[self.dst_idx] = self.plan.output_values[self.src_idx]
+
+
 def get_submodules(mdl):
     attributes = inspect.getmembers(mdl)
     attributes = [a for a in attributes if not (a[0].startswith('__') and a[0].endswith('__'))]
@@ -87,15 +260,68 @@ def get_submodules(mdl):
     return output
 
 
+class OutputBuffer:
+    """
+    Flat buffer for the memoized outputs (see @output) of a set of models. Each (model, output) gets a precomputed
+    slice of the buffer. Stored values are valid if their slot generation equals the generation of the buffer, such
+    that all outputs are invalidated at once by incrementing the generation.
+    """
+    def __init__(self, mdls):
+        self.active = False
+        self.generation = 0
+        self.trace = None
+
+        n_values = 0
+        n_slots = 0
+        for mdl in mdls:
+            mdl._output_buffer = self
+            mdl._output_idx = {}
+            mdl._output_slot = {}
+            for key in mdl.output_list():
+                mdl._output_idx[key] = slice(n_values, n_values + mdl.n_units)
+                mdl._output_slot[key] = n_slots
+                n_values += mdl.n_units
+                n_slots += 1
+
+        self.values = np.zeros(n_values)
+        self.slot_generation = -np.ones(n_slots, dtype=int)
+
+    def invalidate(self):
+        self.generation += 1
+
+
+class OutputStep:
+    """Computes and stores one memoized output, as part of a compiled evaluation schedule."""
+    def __init__(self, buffer, f, mdl, idx, slot):
+        self.buffer = buffer
+        self.f = f
+        self.mdl = mdl
+        self.idx = idx
+        self.slot = slot
+
+    def __call__(self, x, v):
+        buffer = self.buffer
+        buffer.values[self.idx] = self.f(self.mdl, x, v)
+        buffer.slot_generation[self.slot] = buffer.generation
+
+
 def output(f):
+    name = f.__name__
+
     @functools.wraps(f)
     def wrap(self, *args):
-        if self._store_output:
-            if not self._output_ready[f.__name__]:
+        buffer = self._output_buffer
+        if buffer.active:
+            idx = self._output_idx[name]
+            slot = self._output_slot[name]
+            if buffer.slot_generation[slot] != buffer.generation:
                 # print('Output not ready, calculating output')
-                self._output_values[f.__name__] = f(self, *args)
-                self._output_ready[f.__name__] = True
-            return self._output_values[f.__name__]
+                buffer.values[idx] = f(self, *args)
+                buffer.slot_generation[slot] = buffer.generation
+                if buffer.trace is not None:
+                    # Outputs are appended when completed, i.e. after all outputs they depend on
+                    buffer.trace.append(OutputStep(buffer, f, self, idx, slot))
+            return buffer.values[idx]
         else:
             return f(self, *args)
     return wrap
@@ -114,6 +340,8 @@ class DynMdl:
 
 class DAEModel:
     """Base class for dynamic models"""
+    batchable = False  # True if state_derivatives is vectorized over units (see BlockGroup)
+
     def __init__(self, par=None, sys_par=None, first_state_idx=0, n_units=None, **kwargs):
         # type(self)._ids = count(0)
         # self.id = next(type(self)._ids)
@@ -152,10 +380,8 @@ class DAEModel:
         self.add_blocks()
         self.update_block_names()
 
-        self._output_ready = np.zeros(1, dtype=[(var, bool) for var in self.output_list()])
-        self._output_values = np.zeros(self.n_units, dtype=[(var, float) for var in self.output_list()])
+        OutputBuffer([self])  # Replaced by a system-wide buffer in PowerSystemModel.init_dyn_sim
         self._input_values = np.zeros(self.n_units, dtype=[(var, float) for var in self.input_list()])
-        self._store_output = False
         [self.disconnect_input(inp) for inp in self.input_list()]
 
         self.int_par = np.zeros(self.n_units, dtype=[(var, float) for var in self.int_par_list()])
@@ -185,9 +411,7 @@ class DAEModel:
         return []
 
     def reset_outputs(self):
-        self._output_ready[:] = False
-        # for key in self._output_ready.keys():
-        #     self._output_ready[key] = False
+        self._output_buffer.invalidate()
 
     def set_input(self, input_name, value, idx=None):
         if idx is not None:
@@ -275,8 +499,70 @@ class DAEModel:
 #         setattr(type(self), input_name, input)
 
 
+class BlockGroup:
+    """
+    Evaluates the state derivatives of several instances of the same block class (e.g. all TimeConstant-blocks of
+    all AVRs, governors and stabilizers) as one merged block, operating on the concatenated parameters and states.
+    The parameters of the instances are replaced by views of the merged parameters, such that later parameter
+    changes are seen by the merged block. Inputs are still evaluated per instance.
+    """
+    def __init__(self, blocks):
+        self.blocks = blocks
+        mdl_type = type(blocks[0])
+
+        fields = [field for field in blocks[0].par.dtype.names if field != 'name']
+        dtypes = [('name', np.result_type(*[block.par['name'].dtype for block in blocks]))]
+        dtypes += [(field, np.result_type(*[block.par[field].dtype for block in blocks])) for field in fields]
+        par = np.zeros(sum(block.n_units for block in blocks), dtype=dtypes)
+
+        self.input_idx = []
+        state_idx = []
+        start = 0
+        for block in blocks:
+            block_idx = slice(start, start + block.n_units)
+            for field in par.dtype.names:
+                par[field][block_idx] = block.par[field]
+            block.par = par[block_idx]
+            self.input_idx.append(block_idx)
+            state_idx.append(np.arange(block.idx.start, block.idx.stop))
+            start += block.n_units
+
+        self.state_idx = np.concatenate(state_idx)
+        self.block = mdl_type(par=par)
+        self.block.input = self.input
+        self.input_values = np.zeros(start)
+        self.x = None
+
+    @staticmethod
+    def batchable_blocks(mdls):
+        """Returns lists of blocks of the same class that can be merged."""
+        blocks = {}
+        for mdl in mdls:
+            if mdl.batchable and mdl.n_states > 0 and hasattr(mdl, 'state_derivatives'):
+                fields = (type(mdl), mdl.par.dtype.names)
+                blocks.setdefault(fields, []).append(mdl)
+        return [group for group in blocks.values() if len(group) > 1]
+
+    def input(self, x, v):
+        for block, idx in zip(self.blocks, self.input_idx):
+            self.input_values[idx] = block.input(self.x, v)
+        return self.input_values
+
+    def state_derivatives(self, dx, x, v):
+        self.x = x
+        buffer = self.block._output_buffer
+        buffer.invalidate()
+        buffer.active = True
+        dx_loc = np.zeros(len(self.state_idx))
+        self.block.state_derivatives(dx_loc, x[self.state_idx], v)
+        dx[self.state_idx] = dx_loc
+        buffer.active = False
+        self.x = None
+
+
 def auto_init(mdl, x0, v0, output_0):
     submodules = get_submodules(mdl)
+    output_buffers = list({id(submodule._output_buffer): submodule._output_buffer for submodule in submodules}.values())
     n_states_all = len(x0)
     
     # Find states belonging to model:
@@ -307,17 +593,17 @@ def auto_init(mdl, x0, v0, output_0):
         for idx, idx_local in zip(state_idx, state_idx_local):
             x_all_test[idx] = x_test[idx_local]
         
-        for submodule in submodules:
-            submodule.reset_outputs()
-            submodule._store_output = True
+        for buffer in output_buffers:
+            buffer.invalidate()
+            buffer.active = True
 
         dx_all = np.zeros(n_states_all)
         for submodule in submodules:
             if hasattr(submodule, 'state_derivatives'):
                 submodule.state_derivatives(dx_all, x_all_test, v0)
 
-        for submodule in submodules:
-            submodule._store_output = False
+        for buffer in output_buffers:
+            buffer.active = False
 
         dx_mdl = []
         for idx in state_idx:
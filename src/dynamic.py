@@ -8,6 +8,7 @@ from scipy.sparse import diags as sp_diags
 
 import json
 import os
+import pickle
 
 import importlib
 importlib.reload(mdl_lib)
@@ -38,12 +39,17 @@ class PowerSystemModel:
         elif isinstance(model, dict):
             model_data = model
         
+        self.model_data = model_data  # Unmodified model data
         model = model_data.copy()
         self.model = model
 
         self.perform_kron_reduction = False
+        self.sparse_y_bus = False
+        self.pf_method = 'NR'  # 'NR', 'FD_XB', 'FD_BX' or 'DC'
         self.pf_max_it = 10
+        self.pf_max_it_fd = 100
         self.pf_tol = 1e-8
+        self.pf_init = None  # Initial guess (bus voltages) for the Newton-Raphson power flow, flat start if None
 
         self.s_n = model['base_mva']
         self.f_n = model['f']
@@ -52,9 +58,26 @@ class PowerSystemModel:
 
         self.y_bus_lf = None
         self.power_flow_ready = False
+
+        # Incremented whenever the reduced admittance matrix (y_bus_red + y_bus_red_mod) changes, such that the cached
+        # factorization used in solve_algebraic can be checked for staleness
+        self.y_bus_red_generation = 0
+        self._y_bus_red_lu = None
+        self._y_bus_red_lu_generation = -1
+        self._y_bus_red_mod_snapshot = None
+        self._var_adm_compensation = None
+
+        # Variable admittances (dyn_var_adm) are treated as a low-rank correction to the cached factorization if they
+        # touch at most this many buses, otherwise the full matrix is factorized in each call
+        self.var_adm_max_rank = 100
+
+        # Merge identical blocks (e.g. TimeConstant) of all models into vectorized blocks when compiling
+        self.batch_blocks = True
         
         self.setup_ready = False
         self.initialization_ready = False
+        self.evaluation_schedule = None
+        self.state_derivative_mdls = None
 
         if 'transformers' in model:
             model['trafos'] = model['transformers']
@@ -163,30 +186,96 @@ class PowerSystemModel:
 
         self.setup_ready = True
 
-    def build_y_bus_lf(self):
-
-        y_lf = np.zeros((self.n_bus,) * 2, dtype=complex)
-        for mdl in self.mdl_instructions['load_flow_adm']:
-            data, (row_idx, col_idx) = mdl.load_flow_adm()
-            sp_mat = sp.csr_matrix((data.flatten(), (row_idx.flatten(), col_idx.flatten())),
-                                   shape=(self.n_bus,) * 2)
-            y_lf += sp_mat.todense()
+    @property
+    def y_bus_red(self):
+        return self._y_bus_red
+
+    @y_bus_red.setter
+    def y_bus_red(self, value):
+        # Assignments (e.g. "ps.y_bus_red += ..." in Line.event) invalidate the cached factorization
+        self._y_bus_red = value
+        self.y_bus_red_generation += 1
+
+    @property
+    def y_bus_red_mod(self):
+        return self._y_bus_red_mod
+
+    @y_bus_red_mod.setter
+    def y_bus_red_mod(self, value):
+        self._y_bus_red_mod = value
+        self.y_bus_red_generation += 1
+
+    def check_y_bus_red_mod(self):
+        # y_bus_red_mod is typically modified in place (e.g. ps.y_bus_red_mod[i, i] = 1e6 to apply a short circuit),
+        # which can not be detected by the setter. Compare with the content at the last check instead.
+        mod = self.y_bus_red_mod
+        snapshot = self._y_bus_red_mod_snapshot
+        if snapshot is None or not (
+                np.array_equal(snapshot[0], mod.indptr) and
+                np.array_equal(snapshot[1], mod.indices) and
+                np.array_equal(snapshot[2], mod.data)):
+            self._y_bus_red_mod_snapshot = (mod.indptr.copy(), mod.indices.copy(), mod.data.copy())
+            self.y_bus_red_generation += 1
+
+    def factorize_y_bus_red(self):
+        # Sparse LU-factorization of y_bus_red + y_bus_red_mod, which is only recomputed if the matrix has changed
+        # since the last call (i.e. if the generation counter has been incremented).
+        self.check_y_bus_red_mod()
+        if self._y_bus_red_lu_generation != self.y_bus_red_generation:
+            try:
+                self._y_bus_red_lu = sp_linalg.splu(sp.csc_matrix(self.y_bus_red + self.y_bus_red_mod))
+            except RuntimeError:
+                # Singular without the variable admittances (or singular altogether), solve directly instead
+                self._y_bus_red_lu = None
+            self._y_bus_red_lu_generation = self.y_bus_red_generation
+            self._var_adm_compensation = None
+        return self._y_bus_red_lu
+
+    def var_adm_compensation(self, y_lu, var_bus_idx):
+        # Columns of the inverse of the constant admittance matrix for the buses with variable admittances (G), and the
+        # corresponding rows (W = P^T*G), used for the low-rank correction in solve_algebraic. Cached until the
+        # factorization or the set of buses changes.
+        if self._var_adm_compensation is None or not np.array_equal(self._var_adm_compensation[0], var_bus_idx):
+            p = np.zeros((self.n_bus_red, len(var_bus_idx)), dtype=complex)
+            p[var_bus_idx, np.arange(len(var_bus_idx))] = 1
+            g = y_lu.solve(p)
+            self._var_adm_compensation = (var_bus_idx, g, g[var_bus_idx, :])
+        return self._var_adm_compensation[1:]
+
+    def build_y_bus(self, y_bus_type):
+        # Collects the (data, (row, col))-triplets of all models into one COO batch, such that the admittance matrix
+        # is assembled in a single sparse operation (duplicate entries are summed when converting to CSR).
+        mdl_fun = {'lf': 'load_flow_adm', 'dyn': 'dyn_const_adm'}[y_bus_type]
+
+        data_all = [np.zeros(0, dtype=complex)]
+        row_idx_all = [np.zeros(0, dtype=int)]
+        col_idx_all = [np.zeros(0, dtype=int)]
+        for mdl in self.mdl_instructions[mdl_fun]:
+            data, (row_idx, col_idx) = getattr(mdl, mdl_fun)()
+            data_all.append(np.asarray(data, dtype=complex).flatten())
+            row_idx_all.append(np.asarray(row_idx, dtype=int).flatten())
+            col_idx_all.append(np.asarray(col_idx, dtype=int).flatten())
+
+        y_bus = sp.coo_matrix(
+            (np.concatenate(data_all), (np.concatenate(row_idx_all), np.concatenate(col_idx_all))),
+            shape=(self.n_bus,) * 2
+        ).tocsr()
+
+        if not self.sparse_y_bus:
+            y_bus = y_bus.toarray()
+
+        return y_bus
 
+    def build_y_bus_lf(self):
+        y_lf = self.build_y_bus('lf')
         self.y_bus_lf = y_lf
         return y_lf
 
     def build_y_bus_dyn(self):
-
-        y_dyn = np.zeros((self.n_bus,) * 2, dtype=complex)
-        for mdl in self.mdl_instructions['dyn_const_adm']:
-            data, (row_idx, col_idx) = mdl.dyn_const_adm()
-            sp_mat = sp.csr_matrix((data.flatten(), (row_idx.flatten(), col_idx.flatten())), shape=(self.n_bus,) * 2)
-            y_dyn += sp_mat.todense()
-
+        y_dyn = self.build_y_bus('dyn')
         self.y_bus_dyn = y_dyn
         return y_dyn
 
-
     def power_flow(self, print_output=False):
 
         if not self.setup_ready:
@@ -215,12 +304,14 @@ class PowerSystemModel:
         else:
             sl_idx = dps_uf.lookup_strings(self.slack_bus, self.buses['name'])
 
+        # slack_bus can be a list of buses, e.g. one for each island of the system
         for mdl in self.mdl_instructions['load_flow_pv']:
             bus_idx, p, v = mdl.load_flow_pv()
-            if sl_idx in bus_idx:
-                unit_idx = np.argmax(bus_idx == sl_idx)
-                slack_unit = (mdl, unit_idx)
-                self.slack_unit = slack_unit
+            for sl_idx_ in np.atleast_1d(sl_idx):
+                if sl_idx_ in bus_idx:
+                    unit_idx = np.argmax(bus_idx == sl_idx_)
+                    slack_unit = (mdl, unit_idx)
+                    self.slack_unit = slack_unit
             bus_type[bus_idx] = 'PV'
             np.add.at(p_pv, bus_idx, p / self.s_n)
             v_pv[bus_idx] = v
@@ -230,8 +321,18 @@ class PowerSystemModel:
         bus_type[sl_idx] = 'SL'
 
         phi_0 = np.zeros(self.n_bus)
-        self.v_0, self.s_0, converged = dps_uf.newton_rhapson_power_flow(self.y_bus_lf, v_pv, p_pv + p_pq, q_pq, bus_type,
-                                                              self.pf_tol, self.pf_max_it)
+        if self.pf_method == 'NR':
+            self.v_0, self.s_0, converged = dps_uf.newton_rhapson_power_flow(self.y_bus_lf, v_pv, p_pv + p_pq, q_pq, bus_type,
+                                                                  self.pf_tol, self.pf_max_it, self.pf_init)
+        elif self.pf_method in ['FD_XB', 'FD_BX']:
+            self.v_0, self.s_0, converged = dps_uf.fast_decoupled_power_flow(
+                self.y_bus_lf, v_pv, p_pv + p_pq, q_pq, bus_type, self.pf_tol, self.pf_max_it_fd,
+                variant=self.pf_method[3:]
+            )
+        elif self.pf_method == 'DC':
+            self.v_0, self.s_0, converged = dps_uf.dc_power_flow(self.y_bus_lf, v_pv, p_pv + p_pq, bus_type)
+        else:
+            raise ValueError('Unknown power flow method: {}'.format(self.pf_method))
         self.v0 = self.v_0
 
         pv_units_per_bus = np.zeros(self.n_bus, dtype=int)
@@ -248,9 +349,10 @@ class PowerSystemModel:
             bus_idx, p_setp, v = mdl.load_flow_pv()
             q = q_per_pv_unit[bus_idx]
             p = -p_setp / self.s_n
-            if sl_idx in bus_idx:
-                unit_idx = np.argmax(bus_idx == sl_idx)
-                p[unit_idx] = self.s_0[sl_idx].real + -p_setp[unit_idx] / self.s_n + p_pv[sl_idx] + p_pq[sl_idx]
+            for sl_idx_ in np.atleast_1d(sl_idx):
+                if sl_idx_ in bus_idx:
+                    unit_idx = np.argmax(bus_idx == sl_idx_)
+                    p[unit_idx] = self.s_0[sl_idx_].real + -p_setp[unit_idx] / self.s_n + p_pv[sl_idx_] + p_pq[sl_idx_]
                 # p[unit_idx] /= mdl.par['n_par'][unit_idx]
 
             self.load_flow_soln[mdl] = (p + 1j * q) * self.s_n
@@ -260,6 +362,18 @@ class PowerSystemModel:
 
     def kron_reduction(self, y_bus, keep_buses):
         remove_buses = list(set(range(self.n_bus)) - set(keep_buses))
+
+        if len(remove_buses) == 0:
+            # Nothing to eliminate, the reduced system is the full system
+            if sp.issparse(y_bus):
+                self.red_to_full = sp.identity(self.n_bus, dtype=complex, format='csr')
+                return y_bus.tocsr(copy=True)
+            self.red_to_full = np.eye(self.n_bus, dtype=complex)
+            return y_bus.copy()
+
+        if sp.issparse(y_bus):
+            return self.kron_reduction_sparse(y_bus, keep_buses, remove_buses)
+
         y_rr = y_bus[np.ix_(remove_buses, remove_buses)]
         y_rk = y_bus[np.ix_(remove_buses, keep_buses)]
         y_kk = y_bus[np.ix_(keep_buses, keep_buses)]
@@ -271,7 +385,57 @@ class PowerSystemModel:
 
         return y_kk - y_rk.T.dot(np.linalg.inv(y_rr)).dot(y_rk)
 
-    def init_dyn_sim(self):
+    def kron_reduction_sparse(self, y_bus, keep_buses, remove_buses):
+        # Sparse version of kron_reduction: Y_rr is factorized once (sparse LU), and the factorization is reused both
+        # for the Schur complement and for mapping the reduced voltages back to the full system.
+        y_bus = y_bus.tocsr()
+        y_rr = y_bus[remove_buses, :][:, remove_buses].tocsc()
+        y_rk = y_bus[remove_buses, :][:, keep_buses].tocsc()
+        y_kr = y_bus[keep_buses, :][:, remove_buses].tocsr()
+        y_kk = y_bus[keep_buses, :][:, keep_buses].tocsr()
+
+        self.y_rr_lu = y_rr_lu = sp_linalg.splu(y_rr)
+
+        # Only kept buses which are connected to removed buses (boundary buses) get a contribution from the
+        # elimination, so the Schur complement is only solved for these columns.
+        boundary = np.unique(y_rk.tocoo().col)
+        y_red = y_kk
+        if len(boundary) > 0:
+            y_rr_inv_y_rb = y_rr_lu.solve(y_rk[:, boundary].toarray())
+            correction = sp.coo_matrix(y_kr.dot(y_rr_inv_y_rb))
+            y_red = y_kk - sp.csr_matrix(
+                (correction.data, (correction.row, boundary[correction.col])), shape=y_kk.shape
+            )
+
+        # Lazy operator for mapping back to full system (v_full = self.red_to_full.dot(self.v_red)
+        n_bus = self.n_bus
+        n_bus_red = len(keep_buses)
+
+        def red_to_full_matmat(v_red):
+            v_red = np.asarray(v_red).reshape(n_bus_red, -1)
+            v_full = np.zeros((n_bus, v_red.shape[1]), dtype=complex)
+            v_full[keep_buses] = v_red
+            v_full[remove_buses] = -y_rr_lu.solve(np.asarray(y_rk.dot(v_red), dtype=complex))
+            return v_full
+
+        self.red_to_full = sp_linalg.LinearOperator(
+            (n_bus, n_bus_red), matvec=red_to_full_matmat, matmat=red_to_full_matmat, dtype=complex
+        )
+
+        return y_red.tocsr()
+
+    def init_dyn_sim(self, snapshot=None):
+        '''
+        Initializes the dynamic simulation. If a snapshot (see snapshot()) of the same model is given, the power flow
+        and the initialization of the models are skipped, and the initial values are restored from the snapshot.
+        '''
+        if snapshot is not None:
+            if not self.setup_ready:
+                self.setup()
+            self.restore_attributes(self, snapshot['ps'], ['v_0', 's_0', 'slack_bus', 'y_bus_lf'])
+            self.v0 = self.v_0
+            self.power_flow_ready = True
+
         if not self.power_flow_ready:
             self.power_flow()
 
@@ -284,40 +448,43 @@ class PowerSystemModel:
             self.n_states += mdl.n_states * mdl.n_units
             self.state_desc = np.vstack([self.state_desc, mdl.state_desc])
 
+        self.output_buffer = mdl_lib.utils.OutputBuffer(self.dyn_mdls)
+
         self.state_desc_der = self.state_desc.copy()
         self.state_desc_der[:, 1] = np.char.add(np.array(self.n_states * ['d_']), self.state_desc[:, 1])
         self.x_0 = np.zeros(self.n_states)
         self.x0 = self.x_0
 
-        for mdl in self.mdl_instructions['init_from_load_flow']:
-            mdl_lf_soln = self.load_flow_soln[mdl] if mdl in self.load_flow_soln else None
-            mdl.init_from_load_flow(self.x_0, self.v_0, mdl_lf_soln)
+        if snapshot is not None:
+            self.restore_attributes(self, snapshot['ps'], ['x_0'])
+            for mdl, mdl_snapshot in zip(self.dyn_mdls, snapshot['mdls']):
+                self.restore_attributes(mdl, mdl_snapshot)
+        else:
+            for mdl in self.mdl_instructions['init_from_load_flow']:
+                mdl_lf_soln = self.load_flow_soln[mdl] if mdl in self.load_flow_soln else None
+                mdl.init_from_load_flow(self.x_0, self.v_0, mdl_lf_soln)
 
         # Build reduced system
-        self.y_bus_dyn = self.build_y_bus_dyn()
-        self.y_bus_red_full = self.kron_reduction(self.y_bus_dyn, self.bus_idx_red)
+        if snapshot is not None and snapshot['ps']['red_to_full'] is not None:
+            self.restore_attributes(self, snapshot['ps'], ['y_bus_dyn', 'y_bus_red_full', 'red_to_full'])
+        else:
+            self.y_bus_dyn = self.build_y_bus_dyn()
+            self.y_bus_red_full = self.kron_reduction(self.y_bus_dyn, self.bus_idx_red)
         self.y_bus_red = sp.csr_matrix(self.y_bus_red_full)
         self.y_bus_red_mod = sp.csr_matrix(self.y_bus_red_full)*0
+        if snapshot is not None:
+            self.restore_attributes(self, snapshot['ps'], ['y_bus_red', 'y_bus_red_mod'])
 
         # for mdl in self.dyn_mdls:
         #     mdl.sys_par['red_to_full'] = self.red_to_full
 
         self.mdl_connections = mdl_lib.utils.determine_connections(self.dyn_mdls_dict)
-        for mdl, connections in self.mdl_connections.items():
-            for input_key, conn in connections.items():
-                init_vals = mdl._input_values[input_key].copy()
-                def new_input_fun(x, v, conn=conn, mdl=mdl, init_vals=init_vals):
-                    input = init_vals
-                    for c in conn:
-                        source_fun = getattr(self.dyn_mdls_dict[c['container']][c['mdl']], c['output'])
-                        input[c['dest_idx']] = source_fun(x, v)[c['source_idx']]
-                    return input
-                setattr(mdl, input_key, new_input_fun)
-        
+        self.connection_plan = mdl_lib.utils.ConnectionPlan(self.mdl_connections, self.dyn_mdls_dict)
+
         # Initialize state vector
         self.mdl_connections_by_source = mdl_lib.utils.determine_connections(self.dyn_mdls_dict, order_by='output')
         for mdl, connections in self.mdl_connections_by_source.items():
-            if hasattr(mdl, 'init_from_connections'):
+            if hasattr(mdl, 'init_from_connections') and snapshot is None:
                 output_values = np.zeros(mdl.n_units, [(field, float) for field in mdl.output_list()])
                 for output_key, conn in connections.items():
                     init_val = np.zeros(mdl.n_units)
@@ -329,27 +496,150 @@ class PowerSystemModel:
 
                 mdl.init_from_connections(self.x_0, self.v_0, output_values)
 
-    
+        self.connection_plan.compile(self.x_0, self.v_0)
+        self.compile()
+
         self.initialization_ready = True
 
-    def state_derivatives(self, t, x, v_red):
+    snapshot_attributes = [
+        'x_0', 'v_0', 's_0', 'slack_bus', 'y_bus_lf', 'y_bus_dyn', 'y_bus_red_full', 'red_to_full', 'y_bus_red',
+        'y_bus_red_mod',
+    ]
+    snapshot_settings = [
+        'perform_kron_reduction', 'sparse_y_bus', 'pf_method', 'pf_max_it', 'pf_max_it_fd', 'pf_tol',
+        'var_adm_max_rank', 'batch_blocks',
+    ]
 
-        for mdl in self.dyn_mdls:
-            mdl.reset_outputs()
-            mdl._store_output = True
+    def snapshot(self):
+        '''
+        Returns a copy of the numerical state of the initialized model: Initial states and voltages, admittance
+        matrices and all arrays stored in the models (parameters, inputs, internal parameters, connection status
+        etc.). Restoring it with restore() undoes events (e.g. Line.event) and parameter changes, without repeating the
+        power flow and the initialization.
+        '''
+        def copy(value):
+            return value.copy() if isinstance(value, np.ndarray) or sp.issparse(value) else value
+
+        return {
+            'ps': {key: copy(getattr(self, key, None)) for key in self.snapshot_attributes},
+            'mdls': [
+                {key: value.copy() for key, value in vars(mdl).items() if isinstance(value, np.ndarray)}
+                for mdl in self.dyn_mdls
+            ],
+        }
+
+    def restore(self, snapshot):
+        self.restore_attributes(self, snapshot['ps'])
+        for mdl, mdl_snapshot in zip(self.dyn_mdls, snapshot['mdls']):
+            self.restore_attributes(mdl, mdl_snapshot)
+
+    @staticmethod
+    def restore_attributes(obj, values, keys=None):
+        # Arrays are restored in place where possible, since other objects might hold references (or views) to them
+        for key in keys if keys is not None else values.keys():
+            value = values[key]
+            current = vars(obj).get(key)
+            if isinstance(value, np.ndarray) and isinstance(current, np.ndarray) \
+                    and current.shape == value.shape and current.dtype == value.dtype:
+                current[...] = value
+            elif isinstance(value, np.ndarray) or sp.issparse(value):
+                setattr(obj, key, value.copy())
+            else:
+                setattr(obj, key, value)
+
+    def snapshot_data(self):
+        '''
+        Returns the model data, constructor arguments, settings and a snapshot, from which the initialized model can be
+        recreated with from_snapshot_data (e.g. in other processes, or from file with save_snapshot/load_snapshot).
+        The result can be pickled: If the Kron reduction is performed on a sparse system (where red_to_full is a
+        LinearOperator), the reduced system is recomputed when recreating the model.
+        '''
+        snapshot = self.snapshot()
+        red_to_full = snapshot['ps']['red_to_full']
+        if not (isinstance(red_to_full, np.ndarray) or sp.issparse(red_to_full)):
+            snapshot['ps']['red_to_full'] = None
+
+        return {
+            'model': self.model_data,
+            'kwargs': self.constructor_kwargs(),
+            'settings': {key: getattr(self, key) for key in self.snapshot_settings},
+            'snapshot': snapshot,
+        }
+
+    def constructor_kwargs(self):
+        '''Arguments (other than the model data) needed to recreate the model, see snapshot_data.'''
+        return {}
+
+    @classmethod
+    def from_snapshot_data(cls, data, user_mdl_lib=None):
+        ps = cls(data['model'], user_mdl_lib=user_mdl_lib, **data.get('kwargs', {}))
+        for key, value in data['settings'].items():
+            setattr(ps, key, value)
+        ps.init_dyn_sim(snapshot=data['snapshot'])
+        return ps
+
+    def save_snapshot(self, file_path):
+        '''
+        Saves the model data, settings and a snapshot to file (see snapshot_data), such that the initialized model can
+        be recreated with load_snapshot.
+        '''
+        with open(file_path, 'wb') as f:
+            pickle.dump(self.snapshot_data(), f)
+
+    @classmethod
+    def load_snapshot(cls, file_path, user_mdl_lib=None):
+        with open(file_path, 'rb') as f:
+            data = pickle.load(f)
+
+        return cls.from_snapshot_data(data, user_mdl_lib)
+
+    def compile(self):
+        '''
+        Determines a fixed evaluation order of all memoized outputs and connected inputs, by tracing the order in which
+        they are completed during one (lazy) evaluation of the state derivatives. Outputs are completed after the
+        outputs they depend on, so the trace is topologically sorted. Later evaluations run this schedule before
+        calling the state derivatives of the models, such that outputs are read directly from the buffer.
+        '''
+        self.evaluation_schedule = None
+        self.state_derivative_mdls = self.mdl_instructions['state_derivatives']
+        schedule = []
+        self.output_buffer.trace = schedule
+        with np.errstate(all='ignore'):
+            self.state_derivatives(0, self.x_0, self.v_0, trace=schedule)
+        self.output_buffer.trace = None
+        self.evaluation_schedule = schedule
+
+        # Evaluate state derivatives of identical blocks (across models) as one vectorized block
+        if self.batch_blocks:
+            groups = mdl_lib.utils.BlockGroup.batchable_blocks(self.state_derivative_mdls)
+            grouped = set(id(block) for group in groups for block in group)
+            self.state_derivative_mdls = [mdl for mdl in self.state_derivative_mdls if id(mdl) not in grouped]
+            self.state_derivative_mdls += [mdl_lib.utils.BlockGroup(group) for group in groups]
+
+    def state_derivatives(self, t, x, v_red, trace=None):
+
+        self.output_buffer.invalidate()
+        self.output_buffer.active = True
+
+        if self.evaluation_schedule is not None:
+            self.connection_plan.active = True
+            for step in self.evaluation_schedule:
+                step(x, v_red)
+        else:
+            self.connection_plan.evaluate(x, v_red, trace=trace)
 
         dx = np.zeros(self.n_states)
-        for mdl in self.mdl_instructions['state_derivatives']:
+        for mdl in self.state_derivative_mdls:
             mdl.state_derivatives(dx, x, v_red)
 
-        for mdl in self.dyn_mdls:
-            mdl._store_output = False
+        self.connection_plan.deactivate()
+        self.output_buffer.active = False
 
         return dx
 
-    def solve_algebraic(self, t, x):
+    def current_injections(self, t, x):
         '''
-        Solves algebraic equations given states
+        Sum of current injections from all models, at the buses of the reduced system, given states
         :param t:
         :param x:
         :return:
@@ -358,15 +648,59 @@ class PowerSystemModel:
         for mdl in self.mdl_instructions['current_injections']:
             bus_idx_red, i_inj_mdl = mdl.current_injections(x, None)
             np.add.at(i_inj, bus_idx_red, i_inj_mdl)
+        return i_inj
 
-        y_var = np.zeros((self.n_bus,) * 2, dtype=complex)
+    def var_admittance(self, t, x):
+        '''
+        Variable admittances (from models with dyn_var_adm) given states, as (data, (row_idx, col_idx)) of the entries
+        in the reduced admittance matrix (duplicate entries are summed)
+        :param t:
+        :param x:
+        :return:
+        '''
+        data_all = [np.zeros(0, dtype=complex)]
+        row_idx_all = [np.zeros(0, dtype=int)]
+        col_idx_all = [np.zeros(0, dtype=int)]
         for mdl in self.mdl_instructions['dyn_var_adm']:
             data, (row_idx, col_idx) = mdl.dyn_var_adm(x, None)
-            sp_mat = sp.csr_matrix((data.flatten(), (row_idx.flatten(), col_idx.flatten())), shape=(self.n_bus,) * 2)
-            y_var += sp_mat.todense()
-        y_var = sp.csr_matrix(y_var)
+            data_all.append(np.asarray(data, dtype=complex).flatten())
+            row_idx_all.append(np.asarray(row_idx, dtype=int).flatten())
+            col_idx_all.append(np.asarray(col_idx, dtype=int).flatten())
+        return np.concatenate(data_all), (np.concatenate(row_idx_all), np.concatenate(col_idx_all))
 
-        return sp_linalg.spsolve(self.y_bus_red + y_var + self.y_bus_red_mod, i_inj)
+    def solve_algebraic(self, t, x):
+        '''
+        Solves algebraic equations given states
+        :param t:
+        :param x:
+        :return:
+        '''
+        i_inj = self.current_injections(t, x)
+
+        y_lu = self.factorize_y_bus_red()
+        if len(self.mdl_instructions['dyn_var_adm']) == 0:
+            if y_lu is None:
+                return sp_linalg.spsolve(self.y_bus_red + self.y_bus_red_mod, i_inj)
+            return y_lu.solve(i_inj)
+
+        data, (row_idx, col_idx) = self.var_admittance(t, x)
+
+        var_bus_idx = np.unique(np.concatenate([row_idx, col_idx]))
+        if y_lu is None or len(var_bus_idx) > self.var_adm_max_rank:
+            y_var = sp.csr_matrix((data, (row_idx, col_idx)), shape=(self.n_bus_red,) * 2)
+            return sp_linalg.spsolve(self.y_bus_red + y_var + self.y_bus_red_mod, i_inj)
+
+        # The variable admittances only touch a few buses, and are written as y_var = P*y_var_loc*P^T. With v_0 being
+        # the solution without y_var, the solution is v = v_0 - G*y_var_loc*u, where u (voltages at the touched buses)
+        # is found from the small system (I + W*y_var_loc)*u = P^T*v_0.
+        g, w = self.var_adm_compensation(y_lu, var_bus_idx)
+        n_var = len(var_bus_idx)
+        y_var_loc = np.zeros((n_var,) * 2, dtype=complex)
+        np.add.at(y_var_loc, (np.searchsorted(var_bus_idx, row_idx), np.searchsorted(var_bus_idx, col_idx)), data)
+
+        v_0 = y_lu.solve(i_inj)
+        u = np.linalg.solve(np.eye(n_var) + w.dot(y_var_loc), v_0[var_bus_idx])
+        return v_0 - g.dot(y_var_loc.dot(u))
 
     def no_fun(self):
         pass
@@ -0,0 +1,113 @@
+import numpy as np
+import scipy.sparse as sp
+import src.utility_functions as dps_uf
+
+
+class EventQueue:
+    def __init__(self, ps, events=None, tol=1e-10):
+        '''
+        Queue of events, consumed by the solvers (given as events=...). The solvers shorten their steps such that
+        steps end exactly at event times, and all events at the same time are applied at the start of the next step,
+        as one update of y_bus_red and y_bus_red_mod (such that the admittance matrix is only factorized once).
+
+        Events are given as tuples, starting with the time and the type of event:
+            (t, 'fault', bus_name, admittance): Sets the fault admittance of a bus (in y_bus_red_mod), 0 clears the
+                fault
+            (t, 'line', line_name, action): Line event, action is 'connect' or 'disconnect' (see Line.event)
+            (t, 'load', load_name, (P, Q)): Changes the active and reactive power (at initial voltage) of a static load
+            (t, 'input', (category, mdl_key), input_name, value[, unit_name]): Sets the value of an input (e.g. a
+                setpoint) of a model, for all units or for the unit with the given name (see DAEModel.set_input).
+                Inputs which are connected to other models are not affected.
+
+        Example:
+            events = EventQueue(ps, [
+                (1, 'fault', 'B1', 1e6),
+                (1.05, 'fault', 'B1', 0),
+                (1.05, 'line', 'L1-2', 'disconnect'),
+                (5, 'input', ('avr', 'SEXS'), 'v_setp', 1.05, 'AVR1'),
+            ])
+            sol = dps_sol.ModifiedEulerDAE(ps.state_derivatives, ps.solve_algebraic, 0, x0, t_end, events=events)
+        '''
+        self.ps = ps
+        self.tol = tol
+        self.events = []
+        self.k = 0  # Index of next event
+        for event in events if events is not None else []:
+            self.add(event)
+
+    def add(self, event):
+        self.events.append(event)
+        self.events[self.k:] = sorted(self.events[self.k:], key=lambda event: event[0])
+
+    def times(self):
+        return [event[0] for event in self.events[self.k:]]
+
+    def reset(self):
+        '''Makes all events pending again (e.g. after PowerSystemModel.restore).'''
+        self.k = 0
+
+    def next_time(self, t):
+        '''Time of next pending event after t (inf if no more events).'''
+        for event in self.events[self.k:]:
+            if event[0] > t + self.tol:
+                return event[0]
+        return np.inf
+
+    def apply(self, t):
+        '''Applies all pending events up to time t. Returns True if any events were applied.'''
+        ps = self.ps
+        k_0 = self.k
+        y_bus_red_change = None
+        faults = {}
+        while self.k < len(self.events) and self.events[self.k][0] <= t + self.tol:
+            t_event, event_type, *args = self.events[self.k]
+            self.k += 1
+
+            if event_type == 'fault':
+                bus_name, admittance = args
+                bus_idx = dps_uf.lookup_strings(bus_name, ps.buses['name'])
+                if not np.isin(bus_idx, ps.bus_idx_red):
+                    raise ValueError('Bus {} not found in the (reduced) system, fault event failed.'.format(bus_name))
+                faults[np.searchsorted(ps.bus_idx_red, bus_idx)] = admittance
+
+            elif event_type == 'line':
+                line_name, action = args
+                change = ps.lines['Line'].event_admittance(ps, line_name, action)
+                if change is not None:
+                    y_bus_red_change = change if y_bus_red_change is None else y_bus_red_change + change
+
+            elif event_type == 'load':
+                load_name, (p, q) = args
+                mdl = ps.loads['Load']
+                idx = dps_uf.lookup_strings(load_name, mdl.par['name'])
+                if not np.isin(idx, np.arange(mdl.n_units)):
+                    raise ValueError('Load {} not found, load event failed.'.format(load_name))
+                y_load = np.conj((p + 1j*q)/ps.s_n)/abs(mdl.v_0[idx])**2
+                bus_idx_red = mdl.bus_idx_red['terminal'][idx]
+                if bus_idx_red < 0:
+                    raise ValueError('The bus of load {} is not in the reduced system, load event failed.'.format(
+                        load_name))
+                change = sp.csr_matrix(([y_load - mdl.y_load[idx]], ([bus_idx_red], [bus_idx_red])),
+                                       shape=(ps.n_bus_red,)*2)
+                mdl.y_load[idx] = y_load
+                y_bus_red_change = change if y_bus_red_change is None else y_bus_red_change + change
+
+            elif event_type == 'input':
+                (category, mdl_key), input_name, value, *unit_name = args
+                mdl = ps.dyn_mdls_dict[category][mdl_key]
+                idx = dps_uf.lookup_strings(unit_name[0], mdl.par['name']) if len(unit_name) > 0 else None
+                mdl.set_input(input_name, value, idx)
+
+            else:
+                raise ValueError('Unknown event type: {}'.format(event_type))
+
+        # One update of each matrix, such that the (reduced) admittance matrix is only factorized once
+        if y_bus_red_change is not None:
+            ps.y_bus_red = ps.y_bus_red + y_bus_red_change
+        if len(faults) > 0:
+            y_bus_red_mod = ps.y_bus_red_mod.tolil()
+            for bus_idx_red, admittance in faults.items():
+                y_bus_red_mod[bus_idx_red, bus_idx_red] = admittance
+            ps.y_bus_red_mod = y_bus_red_mod.tocsr()
+
+        return self.k > k_0
@@ -1,34 +1,387 @@
 import numpy as np
+import os
+import importlib
+import scipy.linalg
+import scipy.sparse as sp
+from scipy.sparse import linalg as sp_linalg
+from scipy.optimize import linear_sum_assignment
+from concurrent.futures import ProcessPoolExecutor
+import src.dynamic as dps
 import src.utility_functions as utils
+from src.dyn_models.utils import get_submodules, ConnectedInput
 
 
-class PowerSystemModelLinearization:
-    def __init__(self, ps):
-        self.ps = ps
-        self.n = self.ps.n_states
-        self.eps = 1e-10
-        self.linearize_inputs_v2 = self.linearize_inputs
-        self.linearization_ready = False
+class StateSpaceModel:
+    def __init__(self, a, b=None, c=None, d=None):
+        '''
+        Linear system dx/dt = a*x + b*u, y = c*x + d*u, with eigenvalue decomposition, frequency response and time
+        domain simulation. Used for linearized power system models (see PowerSystemModelLinearization), and for reduced
+        models (see modal_truncation and balanced_truncation).
+        '''
+        self.n = a.shape[0]
+        self.a = a
+        self.b = b if b is not None else np.empty((self.n, 0))
+        self.c = c if c is not None else np.empty((0, self.n))
+        self.d = d if d is not None else np.empty((0, 0))
         self.eigenvalues_ready = False
 
-        self.a = np.empty((self.n,)*2)
-        self.b = np.empty((self.n, 0))
-        self.c = np.empty((0, self.n))
-        self.d = np.empty((0, 0))
-
         self.lev = np.empty((self.n,)*2, dtype=complex)
         self.rev = np.empty((self.n,)*2, dtype=complex)
         self.eigs = np.empty(self.n, dtype=complex)
         self.freq = np.empty(self.n)
         self.damping = np.empty(self.n)
 
+    def eigenvalue_decomposition(self):
+        self.eigs, evs = np.linalg.eig(self.a)
+
+        # Right/left rigenvectors (rev/lev)
+        self.rev = evs
+        self.lev = np.linalg.inv(self.rev)
+        # self.damping = -self.eigs.real / abs(self.eigs)
+        self.damping = np.divide(
+            -self.eigs.real, abs(self.eigs),
+            out=np.zeros_like(self.eigs.real)*np.nan,
+            where=self.eigs.real != 0,
+        )
+        self.freq = self.eigs.imag / (2 * np.pi)
+
+        self.eigenvalues_ready = True
+
+    def participation_factors(self):
+        '''
+        Participation factors p[k, i] = rev[k, i]*lev[i, k] of state k in mode i, normalized such that the largest
+        magnitude in each mode is 1
+        '''
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+        participation = self.rev*self.lev.T
+        return participation/abs(participation).max(axis=0)
+
+    def get_mode_idx(self, mode_type=['em', 'non_conj'], damp_threshold=1, freq_range=[0.1, 3], sorted=True):
+        # Get indices of modes from specified criteria.
+        eigs = self.eigs
+        idx = np.ones(len(eigs), dtype=bool)
+        if not isinstance(mode_type, list):
+            mode_type = [mode_type]
+
+        for mt in mode_type:
+            if mt == 'em':
+                idx *= (abs(eigs.imag) / (2 * np.pi) > freq_range[0]) & (abs(eigs.imag) / (2 * np.pi) < freq_range[1])
+            if mt == 'non_conj':
+                idx *= eigs.imag >= 0
+
+        idx *= self.damping < damp_threshold
+
+        idx = np.where(idx)[0]
+        if sorted:
+            idx = idx[np.argsort(self.damping[idx])]
+        return idx
+
+    def get_dominant_mode(self):
+        em_idx = (0.1 < self.freq) & (self.freq < 2)
+        return np.argmin(self.damping)
+
+    def residues(self, mode_idx):
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+        return self.lev.dot(self.b)[[mode_idx], :]*self.c.dot(self.rev)[:, [mode_idx]]
+
+    def frequency_response(self, omega, mode_idx=None, max_elements=2**24):
+        '''
+        Frequency response g(j*omega) = c*(j*omega*I - a)^-1*b + d, evaluated from the modal form of the system,
+        g(j*omega) = sum_i (c*rev[:, i])*(lev[i, :]*b)/(j*omega - eigs[i]) + d. Once the eigenvalue decomposition is
+        done, each frequency only costs a weighted sum of the residues (see residues) of the modes, and all
+        frequencies are evaluated at once.
+
+        If only some modes are computed (e.g. with eigenvalue_decomposition_sparse), or mode_idx is given, the response
+        only includes these modes (modal truncation).
+        :param omega: Angular frequencies (rad/s)
+        :param mode_idx: Indices of modes to include (default: all computed modes)
+        :param max_elements: Frequencies are evaluated in chunks, such that the intermediate arrays have at most this
+        number of elements
+        :return: Frequency response (n_omega x n_outputs x n_inputs)
+        '''
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+
+        if mode_idx is None:
+            mode_idx = np.arange(len(self.eigs))
+            if len(self.eigs) < self.n:
+                print('Only {} of {} modes are computed, and included in the frequency response.'.format(
+                    len(self.eigs), self.n))
+
+        eigs = self.eigs[mode_idx]
+        c_rev = self.c.dot(self.rev[:, mode_idx])
+        lev_b = self.lev[mode_idx, :].dot(self.b)
+        d = self.d if self.d.shape == (self.c.shape[0], self.b.shape[1]) else np.zeros((self.c.shape[0], self.b.shape[1]))
+
+        omega = np.atleast_1d(omega)
+        g = np.zeros((len(omega), c_rev.shape[0], lev_b.shape[1]), dtype=complex)
+        chunk = max(1, max_elements // max(1, len(eigs)*max(c_rev.shape[0], lev_b.shape[1])))
+        for start in range(0, len(omega), chunk):
+            omega_chunk = omega[start:start + chunk]
+            weights = 1/(1j*omega_chunk[:, None] - eigs[None, :])
+            g[start:start + chunk] = np.einsum('pi,wi,im->wpm', c_rev, weights, lev_b, optimize=True) + d
+
+        return g
+
+    def simulate(self, t, u=None, x_0=None, method='modal', mode_idx=None, return_states=True, max_elements=2**24):
+        '''
+        Simulates the linearized system dx/dt = a*x + b*u, y = c*x + d*u, where x and y are deviations from the
+        operating point. The inputs are held constant between the time steps (zero-order hold), and the system is
+        discretized exactly, x[k+1] = exp(a*dt)*x[k] + (integral of exp(a*s) over dt)*b*u[k], such that the step
+        length only affects the resolution of the inputs and results. The discrete system is found once, and each step
+        is a matrix product (method='expm'), or only a scaling of the modal coordinates lev*x (method='modal', using the
+        eigenvalue decomposition).
+
+        Several input profiles (and initial states) can be given at once, and are simulated together (batched).
+        :param t: Time steps (equally spaced)
+        :param u: Inputs (n_t x n_inputs), or a batch of input profiles (n_batch x n_t x n_inputs)
+        :param x_0: Initial deviation of the states (n), or one for each input profile (n_batch x n). Default: zero
+        :param method: 'modal' or 'expm'
+        :param mode_idx: Modes to include with method='modal' (default: all computed modes, see frequency_response)
+        :param return_states: Return the states in addition to the outputs
+        :param max_elements: The (modal) coordinates are converted to states and outputs in blocks of time steps, with
+        at most this number of elements
+        :return: dict with time, states (n_t x n, or n_batch x n_t x n) and outputs (n_t x n_outputs, or
+        n_batch x n_t x n_outputs)
+        '''
+        t = np.asarray(t)
+        dt = t[1] - t[0]
+        if not np.allclose(np.diff(t), dt):
+            raise ValueError('The time steps must be equally spaced.')
+
+        n_inputs = self.b.shape[1]
+        u = np.zeros((len(t), n_inputs)) if u is None else np.asarray(u)
+        x_0 = np.zeros(self.n) if x_0 is None else np.asarray(x_0)
+        batched = u.ndim == 3 or x_0.ndim == 2
+        u = u if u.ndim == 3 else u[None]
+        x_0 = x_0 if x_0.ndim == 2 else x_0[None]
+        n_batch = max(len(u), len(x_0))
+        u = np.broadcast_to(u, (n_batch, len(t), n_inputs))
+        x_0 = np.broadcast_to(x_0, (n_batch, self.n))
+        d = self.d if self.d.shape == (self.c.shape[0], n_inputs) else np.zeros((self.c.shape[0], n_inputs))
+
+        if method == 'modal':
+            if not self.eigenvalues_ready:
+                self.eigenvalue_decomposition()
+            mode_idx = np.arange(len(self.eigs)) if mode_idx is None else mode_idx
+            eigs = self.eigs[mode_idx]
+            rev = self.rev[:, mode_idx]
+            lev = self.lev[mode_idx, :]
+
+            # Exact discretization of each mode (with the limit dt for eigenvalues at the origin), in the modal
+            # coordinates z = lev*x
+            a_d = np.exp(eigs*dt)
+            gain = np.divide(a_d - 1, eigs, out=np.full(len(eigs), dt, dtype=complex), where=abs(eigs*dt) > 1e-12)
+            b_d = gain[:, None]*lev.dot(self.b)
+            z_0 = x_0.dot(lev.T)
+            states, outputs = rev, self.c.dot(rev)
+
+            def step(z):
+                return a_d*z
+
+        elif method == 'expm':
+            # Both matrices are found from the exponential of the augmented matrix [[a, b], [0, 0]]*dt
+            m = np.zeros((self.n + n_inputs,)*2, dtype=np.result_type(self.a, self.b))
+            m[:self.n, :self.n] = self.a
+            m[:self.n, self.n:] = self.b
+            m_d = scipy.linalg.expm(m*dt)
+            a_d = m_d[:self.n, :self.n]
+            b_d = m_d[:self.n, self.n:]
+            z_0 = x_0
+            states, outputs = None, self.c
+
+            def step(z):
+                return z.dot(a_d.T)
+
+        else:
+            raise ValueError('Unknown method: {}'.format(method))
+
+        # The states (and outputs) are real if the inputs are, and imaginary parts (of modal results) are rounding errors
+        real = np.isrealobj(x_0) and np.isrealobj(u) and np.isrealobj(self.b) and np.isrealobj(self.a)
+        dtype_x = float if real else complex
+        dtype_y = float if real and np.isrealobj(self.c) else complex
+
+        # The coordinates of a block of steps are buffered, and converted to states and outputs by one product each
+        x = np.zeros((n_batch, len(t), self.n), dtype=dtype_x) if return_states else None
+        y = np.zeros((n_batch, len(t), self.c.shape[0]), dtype=dtype_y)
+        b_d = b_d.astype(np.result_type(b_d, z_0))
+        n_block = max(1, max_elements // (n_batch*len(z_0[0])))
+        z_block = np.zeros((n_batch, min(n_block, len(t)), len(z_0[0])), dtype=b_d.dtype)
+
+        def convert(arr, mat):
+            return arr.reshape(-1, arr.shape[-1]).dot(mat.T).reshape(arr.shape[:-1] + (mat.shape[0],))
+
+        z = z_0.astype(b_d.dtype)
+        for start in range(0, len(t), n_block):
+            stop = min(start + n_block, len(t))
+            for k in range(start, stop):
+                z_block[:, k - start] = z
+                if k < len(t) - 1:
+                    z = step(z) + u[:, k].astype(b_d.dtype).dot(b_d.T)
+
+            y_block = convert(z_block[:, :stop - start], outputs)
+            y[:, start:stop] = y_block.real if dtype_y == float else y_block
+            if return_states:
+                x_block = z_block[:, :stop - start] if states is None else convert(z_block[:, :stop - start], states)
+                x[:, start:stop] = x_block.real if dtype_x == float else x_block
+
+        if d.any():
+            y = y + convert(u, d)
+
+        res = {'t': t, 'y': y, 'x': x} if return_states else {'t': t, 'y': y}
+        if not batched:
+            res = {key: val[0] if key != 't' else val for key, val in res.items()}
+        return res
+
+    def real_modal_basis(self, mode_idx):
+        '''
+        Real basis of the modes mode_idx (with the complex conjugate of each oscillatory mode included), i.e. matrices t
+        and w with w*t = I such that the part of the states in the modes is t*w*x. For each pair of modes, w*x holds the
+        real and imaginary part of the modal coordinate lev[i]*x.
+        :return: t (n x k) and w (k x n)
+        '''
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+
+        t, w = [], []
+        done = set()
+        for i in np.atleast_1d(mode_idx):
+            eig = self.eigs[i]
+            if abs(eig.imag) <= 1e-8*(1 + abs(eig)):
+                # Eigenvectors of real modes are real, apart from an arbitrary complex scaling
+                phase = np.exp(-1j*np.angle(self.rev[np.argmax(abs(self.rev[:, i])), i]))
+                t.append([(self.rev[:, i]*phase).real])
+                w.append([(self.lev[i, :]/phase).real])
+                continue
+            if eig.imag < 0:
+                i = np.argmin(abs(self.eigs - eig.conj()))
+            if i not in done:
+                done.add(i)
+                t.append([2*self.rev[:, i].real, -2*self.rev[:, i].imag])
+                w.append([self.lev[i, :].real, self.lev[i, :].imag])
+
+        return np.array(sum(t, [])).reshape(-1, self.n).T, np.array(sum(w, [])).reshape(-1, self.n)
+
+    def project(self, t, w):
+        '''
+        Reduced model from the projection x = t*x_r, x_r = w*x, with w*t = I. The reduced state matrix w*a*t is found
+        from the eigenvalue decomposition, such that the state matrix is not needed (e.g. with the descriptor form).
+        :return: Reduced model (StateSpaceModel), with the projection matrices as attributes t and w
+        '''
+        a_r = (w.dot(self.rev)*self.eigs).dot(self.lev.dot(t))
+        real = np.isrealobj(t) and np.isrealobj(w)
+        reduced = StateSpaceModel(a_r.real if real else a_r, w.dot(self.b), self.c.dot(t), self.d)
+        reduced.t = t
+        reduced.w = w
+        return reduced
+
+    def modal_truncation(self, mode_idx):
+        '''
+        Reduced model with only the modes mode_idx (e.g. from get_mode_idx), in real modal coordinates (see
+        real_modal_basis). The complex conjugates of oscillatory modes are included, such that e.g. the modes found
+        with mode_type=['em', 'non_conj'] give a reduced model with two states per electromechanical mode.
+        :return: Reduced model (StateSpaceModel)
+        '''
+        return self.project(*self.real_modal_basis(mode_idx))
+
+    def balanced_truncation(self, order=None, hsv_tol=1e-6, gramian_tol=1e-12, stability_margin=1e-6):
+        '''
+        Reduced model by balanced truncation, keeping the states with the largest Hankel singular values (the
+        states that are both well controllable from the inputs and well observable from the outputs). Modes with
+        real part above -stability_margin (e.g. the zero eigenvalue of the rotor angles), for which the gramians are
+        not defined, are kept unchanged (as with modal_truncation), and only the stable part of the system is balanced.
+
+        The gramians of the stable part are found in modal coordinates, where they are Cauchy-like matrices
+        p[i, j] = -g[i]*g[j]^H/(eig[i] + eig[j]^*), with g = lev*b (and similarly with c*rev for the observability
+        gramian). Low rank factors (p = z*z^H) are found by pivoted Cholesky factorization, such that only the
+        columns of the gramians that are needed are computed. The reduced model is found by the square root method.
+        :param order: Number of states of the balanced (stable) part. Default: number of Hankel singular values above
+        hsv_tol times the largest.
+        :param hsv_tol: Relative tolerance of Hankel singular values (if order is not given)
+        :param gramian_tol: Relative tolerance of the low rank factors of the gramians
+        :param stability_margin: Modes with real part above -stability_margin are not balanced
+        :return: Reduced model (StateSpaceModel), with the Hankel singular values as attribute hsv
+        '''
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+        if len(self.eigs) < self.n:
+            print('Only {} of {} modes are computed, and included in the reduced model.'.format(len(self.eigs), self.n))
+
+        stable = self.eigs.real < -stability_margin
+        eigs = self.eigs[stable]
+
+        def low_rank_factor(g):
+            # Pivoted Cholesky factorization of the gramian -g*g^H/(eigs[i] + eigs[j]^*)
+            diag = -np.sum(abs(g)**2, axis=1)/(2*eigs.real)
+            residual = diag.copy()
+            z = np.zeros((len(eigs), 0), dtype=complex)
+            rank = 0
+            while rank < len(eigs) and residual.max() > gramian_tol*diag.max():
+                if rank == z.shape[1]:
+                    z = np.hstack([z, np.zeros((len(eigs), max(rank, 16)), dtype=complex)])
+                j = np.argmax(residual)
+                column = -g.dot(g[j].conj())/(eigs + eigs[j].conj()) - z[:, :rank].dot(z[j, :rank].conj())
+                z[:, rank] = column/np.sqrt(residual[j])
+                residual = np.maximum(residual - abs(z[:, rank])**2, 0)
+                rank += 1
+            return z[:, :rank]
+
+        # Real factors of the gramians in the original coordinates
+        z_c = self.rev[:, stable].dot(low_rank_factor(self.lev[stable, :].dot(self.b)))
+        z_o = self.lev[stable, :].T.dot(low_rank_factor(self.c.dot(self.rev[:, stable]).T))
+        z_c = np.hstack([z_c.real, z_c.imag])
+        z_o = np.hstack([z_o.real, z_o.imag])
+
+        u, hsv, vh = np.linalg.svd(z_o.T.dot(z_c), full_matrices=False)
+        if order is None:
+            order = np.sum(hsv > hsv_tol*hsv[0]) if len(hsv) > 0 else 0
+        order = min(order, np.sum(hsv > 0))
+        scale = 1/np.sqrt(hsv[:order])
+        t_s = z_c.dot(vh[:order].T)*scale
+        w_s = (z_o.dot(u[:, :order])*scale).T
+
+        t_u, w_u = self.real_modal_basis(np.where(~stable)[0])
+        reduced = self.project(np.hstack([t_u, t_s]), np.vstack([w_u, w_s]))
+        reduced.hsv = hsv
+        return reduced
+
+
+class PowerSystemModelLinearization(StateSpaceModel):
+    def __init__(self, ps):
+        super().__init__(np.empty((ps.n_states,)*2))
+        self.ps = ps
+        self.eps = 1e-10
+        self.linearize_inputs_v2 = self.linearize_inputs
+        self.linearization_ready = False
+
+        # Compute the state matrix from sparse Jacobians of the states and network equations (see jacobian_sparse),
+        # using the sparsity pattern found from the model and connection structure (see sparsity_pattern)
+        self.sparse_jacobian = True
+        self.sparsity = None
+
+        # Keep the network equations, and linearize to the sparse descriptor system e*dz/dt = j*z (see
+        # linearize_descriptor) instead of the dense state matrix a
+        self.descriptor = False
+        self.e_desc = None
+        self.j_desc = None
+
     def linearize(self, get_eigs=False, ps=None, t0=0, x0=np.array([]), input_description=np.array([]), output_description=np.array([])):
         # Linearizes non-linear ODEs at operating point x0.
-        if ps:
+        if ps and ps is not self.ps:
+            # The cached sparsity pattern (and the dimension) belong to the previous model
             self.ps = ps
+            self.n = ps.n_states
+            self.sparsity = None
 
         self.x0 = x0 if len(x0) > 0 else self.ps.x0
-        self.a = utils.jacobian_num(lambda x: self.ps.ode_fun(t0, x), self.x0, eps=self.eps)
+        if self.descriptor:
+            self.linearize_descriptor(t0, self.x0)
+        elif self.sparse_jacobian:
+            self.a = self.jacobian_sparse(t0, self.x0)
+        else:
+            self.a = utils.jacobian_num(lambda x: self.ps.ode_fun(t0, x), self.x0, eps=self.eps)
         # self.n = self.a.shape[0]
 
         if len(input_description) > 0:
@@ -48,29 +401,521 @@ class PowerSystemModelLinearization:
 
         self.linearization_ready = True
 
-    def residues(self, mode_idx):
-        if not self.eigenvalues_ready:
-            self.eigenvalue_decomposition()
-        return self.lev.dot(self.b)[[mode_idx], :]*self.c.dot(self.rev)[:, [mode_idx]]
+    def unit_dependencies(self):
+        '''
+        Dependencies between the units of the models, from the model and connection structure. Each unit of a model
+        (including its submodules) is assumed to only depend on its own states and buses, and on the units connected to
+        its inputs (also indirectly). This is conservative, since all outputs are assumed to depend on all states, buses
+        and inputs of the unit.
+        :return: dicts with states, buses, units it depends on, and rows of the network currents (buses) it affects,
+        for each unit (keys are (id(mdl), unit))
+        '''
+        ps = self.ps
+        mdls = [mdl for category in ps.dyn_mdls_dict.values() for mdl in category.values()]
+
+        # States and buses of each unit of each (top level) model
+        states = {}
+        buses = {}
+        parent = {}
+        for mdl in mdls:
+            unit_states = [set() for _ in range(mdl.n_units)]
+            for submodule in get_submodules(mdl):
+                parent[id(submodule)] = mdl
+                if submodule.n_states == 0:
+                    continue
+                idx = np.array([submodule.state_idx_global[state] for state in submodule.state_list()]).T
+                for unit, unit_idx in enumerate(idx if submodule.n_units == mdl.n_units else [idx.flatten()]*mdl.n_units):
+                    unit_states[unit].update(unit_idx)
+
+            unit_buses = [set() for _ in range(mdl.n_units)]
+            bus_idx_red = getattr(mdl, 'bus_idx_red', None)
+            if isinstance(bus_idx_red, np.ndarray) and bus_idx_red.dtype.names is not None:
+                for field in bus_idx_red.dtype.names:
+                    for unit, bus in enumerate(bus_idx_red[field]):
+                        if bus >= 0:
+                            unit_buses[unit].add(bus)
+
+            for unit in range(mdl.n_units):
+                states[id(mdl), unit] = unit_states[unit]
+                buses[id(mdl), unit] = unit_buses[unit]
+
+        # Units depend on the units connected to their inputs (also indirectly)
+        deps = {key: {key} for key in states.keys()}
+        edges = []
+        for dest_mdl, inputs in ps.mdl_connections.items():
+            for connections in inputs.values():
+                for conn in connections:
+                    source_mdl = ps.dyn_mdls_dict[conn['container']][conn['mdl']]
+                    for source_unit, dest_unit in zip(conn['source_idx'], conn['dest_idx']):
+                        edges.append(((id(dest_mdl), dest_unit), (id(source_mdl), source_unit)))
+
+        changed = True
+        while changed:
+            changed = False
+            for dest, source in edges:
+                if not deps[source] <= deps[dest]:
+                    deps[dest] |= deps[source]
+                    changed = True
+
+        # Network currents (rows) affected by each unit. Current injections and variable admittances are assigned to
+        # units if there is one entry per unit, or else to all units of the model.
+        currents = {key: set() for key in states.keys()}
+
+        def add_currents(mdl, rows):
+            mdl = parent[id(mdl)]
+            rows = np.atleast_1d(rows).flatten()
+            for unit in range(mdl.n_units):
+                currents[id(mdl), unit].update([rows[unit]] if len(rows) == mdl.n_units else rows)
+
+        for mdl in ps.mdl_instructions['current_injections']:
+            bus_idx_red, _ = mdl.current_injections(self.x0, None)
+            add_currents(mdl, bus_idx_red)
+
+        for mdl in ps.mdl_instructions['dyn_var_adm']:
+            data, (row_idx, _) = mdl.dyn_var_adm(self.x0, None)
+            add_currents(mdl, np.unique(row_idx))
+
+        return {'states': states, 'buses': buses, 'deps': deps, 'currents': currents, 'parent': parent}
+
+    def sparsity_pattern(self):
+        '''
+        Determines the sparsity pattern of the state derivatives f(x, v) and of the network currents
+        r(x) = i_inj(x) - y_var(x)*v (with voltages v kept constant) from the model and connection structure (see
+        unit_dependencies).
+        :return: Patterns (sparse, boolean) of [f; r] with respect to x, and of f with respect to v
+        '''
+        ps = self.ps
+        units = self.unit_dependencies()
+
+        rows_x, cols_x, rows_v, cols_v = [], [], [], []
+        for key, deps in units['deps'].items():
+            x_deps = list(set().union(*[units['states'][dep] for dep in deps]))
+            v_deps = list(set().union(*[units['buses'][dep] for dep in deps]))
+            rows = list(units['states'][key]) + [ps.n_states + bus for bus in units['currents'][key]]
+            for row in rows:
+                rows_x += [row]*len(x_deps)
+                cols_x += x_deps
+            for row in units['states'][key]:
+                rows_v += [row]*len(v_deps)
+                cols_v += v_deps
+
+        sparsity_x = sp.csc_matrix(
+            (np.ones(len(rows_x), dtype=bool), (rows_x, cols_x)), shape=(ps.n_states + ps.n_bus_red, ps.n_states))
+        sparsity_v = sp.csc_matrix(
+            (np.ones(len(rows_v), dtype=bool), (rows_v, cols_v)), shape=(ps.n_states, ps.n_bus_red))
+        return sparsity_x, sparsity_v
+
+    def sparse_jacobians(self, t0=0, x0=np.array([])):
+        '''
+        Sparse Jacobians of the state derivatives f(x, v) and of the network currents r(x) = i_inj(x) - y_var(x)*v,
+        computed with colored finite differences (all states/voltages without common nonzero rows are perturbed in the
+        same evaluation). The network equations are y*v = r(x), with y = y_bus_red + y_bus_red_mod (+ y_var).
+        :return: f_x, f_v_re, f_v_im (derivatives with respect to real/imaginary parts of v), r_x (complex), v0
+        '''
+        ps = self.ps
+        x0 = x0 if len(x0) > 0 else self.ps.x0
+        n_bus = ps.n_bus_red
+        sparsity_x, colors_x, _, _ = self.jacobian_sparsity(x0)
+
+        v0 = ps.solve_algebraic(t0, x0)
+
+        def f_x(x):
+            return self.state_and_current_derivatives(t0, x, v0)
+
+        jac_x = utils.jacobian_num_sparse(f_x, x0, sparsity_x, eps=self.eps, colors=colors_x)
+        jac_x = jac_x.tocsr()
+        r_x = jac_x[ps.n_states:ps.n_states + n_bus] + 1j*jac_x[ps.n_states + n_bus:]
+        f_v_re, f_v_im = self.voltage_jacobians(t0, x0, v0)
+        return jac_x[:ps.n_states], f_v_re, f_v_im, r_x.tocsc(), v0
+
+    def voltage_jacobians(self, t0=0, x0=np.array([]), v0=None):
+        '''
+        Sparse Jacobians of the state derivatives with respect to the real and imaginary parts of the bus voltages (as
+        in sparse_jacobians, without the derivatives with respect to the states).
+        :return: f_v_re, f_v_im
+        '''
+        ps = self.ps
+        x0 = x0 if len(x0) > 0 else self.ps.x0
+        n_bus = ps.n_bus_red
+        _, _, sparsity_v, colors_v = self.jacobian_sparsity(x0)
+        v0 = v0 if v0 is not None else ps.solve_algebraic(t0, x0)
+
+        def f_v(v):
+            return ps.state_derivatives(t0, x0, v[:n_bus] + 1j*v[n_bus:])
+
+        jac_v = utils.jacobian_num_sparse(f_v, np.concatenate([v0.real, v0.imag]), sparsity_v, eps=self.eps,
+                                          colors=colors_v)
+        return jac_v[:, :n_bus], jac_v[:, n_bus:]
+
+    def jacobian_sparsity(self, x0):
+        # Sparsity patterns (and column colorings) of the Jacobians with respect to the states and voltages, found once
+        ps = self.ps
+        if self.sparsity is None:
+            self.x0 = x0
+            sparsity_x, sparsity_v = self.sparsity_pattern()
+            sparsity_x = sp.vstack([sparsity_x, sparsity_x[ps.n_states:]]).tocsc()
+            sparsity_v = sp.hstack([sparsity_v, sparsity_v]).tocsc()
+            self.sparsity = (
+                sparsity_x, utils.color_columns(sparsity_x),
+                sparsity_v, utils.color_columns(sparsity_v),
+            )
+        return self.sparsity
+
+    def state_and_current_derivatives(self, t, x, v):
+        # State derivatives and network currents r = i_inj(x) - y_var(x)*v (real and imaginary parts), given voltages v
+        ps = self.ps
+        data, (row_idx, col_idx) = ps.var_admittance(t, x)
+        r = ps.current_injections(t, x)
+        np.subtract.at(r, row_idx, data*v[col_idx])
+        return np.concatenate([ps.state_derivatives(t, x, v), r.real, r.imag])
+
+    def jacobian_sparse(self, t0=0, x0=np.array([])):
+        '''
+        State matrix (dense) of the network-reduced system, a = f_x + f_v*dv/dx, with dv/dx = y^-1*r_x found from one
+        sparse factorization of the admittance matrix (see sparse_jacobians).
+        '''
+        x0 = x0 if len(x0) > 0 else self.ps.x0
+        f_x, f_v_re, f_v_im, r_x, v0 = self.sparse_jacobians(t0, x0)
+        return self.eliminate_network(f_x, r_x, f_v_re, f_v_im, self.admittance_matrix(t0, x0))
+
+    def admittance_matrix(self, t0=0, x0=np.array([])):
+        # Admittance matrix of the reduced system, including variable admittances at x0
+        ps = self.ps
+        x0 = x0 if len(x0) > 0 else self.ps.x0
+        data, (row_idx, col_idx) = ps.var_admittance(t0, x0)
+        y_var = sp.csr_matrix((data, (row_idx, col_idx)), shape=(ps.n_bus_red,)*2)
+        return sp.csr_matrix(ps.y_bus_red + ps.y_bus_red_mod + y_var)
+
+    @staticmethod
+    def eliminate_network(f_z, r_z, f_v_re, f_v_im, y):
+        # Derivatives (dense) of the state derivatives with respect to z (states or inputs) with the network equations
+        # eliminated, f_z + f_v*dv/dz, with y*dv/dz = r_z
+        f_z = f_z.toarray()
+        cols = np.unique(r_z.nonzero()[1])
+        if len(cols) > 0:
+            dv_dz = sp_linalg.splu(sp.csc_matrix(y)).solve(r_z[:, cols].toarray())
+            f_z[:, cols] += f_v_re.dot(dv_dz.real) + f_v_im.dot(dv_dz.imag)
+        return f_z
+
+    def linearize_descriptor(self, t0=0, x0=np.array([])):
+        '''
+        Linearizes the system without eliminating the network equations, giving the sparse descriptor system
+        e*dz/dt = j*z, with z = [x, v_re, v_im] (states and real/imaginary parts of the bus voltages of the reduced
+        system), e = diag(1, ..., 1, 0, ..., 0) and
+            j = [[f_x,        f_v_re,     f_v_im],
+                 [re(r_x),    -re(y),     im(y)],
+                 [im(r_x),    -im(y),     -re(y)]],
+        where the two last block rows are the network equations 0 = r(x) - y*v (see sparse_jacobians).
+        :return: e, j (sparse)
+        '''
+        ps = self.ps
+        x0 = x0 if len(x0) > 0 else self.ps.x0
+        f_x, f_v_re, f_v_im, r_x, v0 = self.sparse_jacobians(t0, x0)
+        y = self.admittance_matrix(t0, x0)
+
+        self.j_desc = sp.bmat([
+            [f_x, f_v_re, f_v_im],
+            [r_x.real, -y.real, y.imag],
+            [r_x.imag, -y.imag, -y.real],
+        ], format='csc')
+        n_desc = ps.n_states + 2*ps.n_bus_red
+        self.e_desc = sp.diags(np.arange(n_desc) < ps.n_states, dtype=float, format='csc')
+        return self.e_desc, self.j_desc
+
+    def eigs_descriptor(self, sigma=0, k=6, left=False, cluster_tol=1e-6, tol=0):
+        '''
+        Computes the k eigenvalues of the descriptor system (see linearize_descriptor) closest to sigma, by shift-invert
+        Arnoldi iterations on the sparse pencil (j, e), i.e. eigenvalues mu = 1/(lambda - sigma) of (j - sigma*e)^-1*e.
+        The infinite eigenvalues of the pencil (from the network equations) are mapped to mu = 0, and are not found.
+        :param sigma: Shift (complex)
+        :param k: Number of eigenvalues
+        :param left: Also compute left eigenvectors
+        :param cluster_tol: Relative tolerance for eigenvalues to be treated as repeated, when pairing left and right
+        eigenvectors
+        :param tol: Relative accuracy of the eigenvalues (0: machine precision), see scipy.sparse.linalg.eigs
+        :return: Eigenvalues, right eigenvectors (state part, columns) and, if left=True, left eigenvectors (state part,
+        rows, scaled such that lev.dot(rev) = I, as for the state matrix a)
+        '''
+        if self.j_desc is None:
+            self.linearize_descriptor()
+        n = self.ps.n_states
+        e, j = self.e_desc, self.j_desc
+        lu = sp_linalg.splu(sp.csc_matrix(j - sigma*e, dtype=complex))
+        op = sp_linalg.LinearOperator(j.shape, matvec=lambda z: lu.solve(e.dot(z).astype(complex)), dtype=complex)
+        mu, z = sp_linalg.eigs(op, k=k, which='LM', ncv=min(j.shape[0], max(2*k + 1, 40)), tol=tol)
+        eigs = sigma + 1/mu
+        rev = z[:n]
+        if not left:
+            return eigs, rev
+        return eigs, rev, self.left_eigenvectors_descriptor(eigs, rev, cluster_tol)
+
+    def left_eigenvectors_descriptor(self, eigs, rev, cluster_tol=1e-6):
+        '''
+        Left eigenvectors w (w^T*j = lambda*w^T*e) of the descriptor system, for eigenvalues and right eigenvectors found
+        with eigs_descriptor. They are found by inverse iterations on the transposed pencil, shifted to each cluster of
+        (numerically) repeated eigenvalues, e.g. from identical units. Within a cluster, any combination of the left
+        eigenvectors is a left eigenvector, and the combination with lev_c.dot(rev_c) = I is used. Between different
+        eigenvalues, lev.dot(rev) = 0 holds already.
+        :param eigs: Eigenvalues
+        :param rev: Right eigenvectors (state part, columns)
+        :param cluster_tol: Relative tolerance for eigenvalues to be treated as repeated
+        :return: Left eigenvectors (state part, rows), scaled such that lev.dot(rev) = I
+        '''
+        n = self.ps.n_states
+        e, j = self.e_desc, self.j_desc
+        lev = np.zeros((len(eigs), n), dtype=complex)
+        paired = np.zeros(len(eigs), dtype=bool)
+        for i, eig in enumerate(eigs):
+            if paired[i]:
+                continue
+            scale = max(1, abs(eig))
+            cluster = np.where((abs(eigs - eig) <= cluster_tol*scale) & ~paired)[0]
+            lu_c = sp_linalg.splu(sp.csc_matrix(j - (eig + 1e-3*cluster_tol*scale)*e, dtype=complex))
+            # Start from conj(v), which has a component along the left eigenvectors (conj(v)^T*e*v = |v|^2)
+            w_c = np.zeros((j.shape[0], len(cluster)), dtype=complex)
+            w_c[:n] = np.conj(rev[:, cluster])
+            for _ in range(2):
+                w_c = lu_c.solve(e.T.dot(w_c).astype(complex), trans='T')
+                w_c /= np.linalg.norm(w_c, axis=0)
+            w_c = w_c[:n].T
+            lev[cluster] = np.linalg.pinv(w_c.dot(rev[:, cluster])).dot(w_c)
+            paired[cluster] = True
+        return lev
+
+    def eigenspace_descriptor(self, eig, m=1, cluster_tol=1e-6):
+        '''
+        All eigenvalues of the descriptor system within cluster_tol of eig, with right eigenvectors, by inverse subspace
+        iterations on the pencil shifted close to eig. Arnoldi iterations (eigs_descriptor) find repeated eigenvalues
+        (e.g. from identical units) only through rounding errors, such that some of them can be missed. The dimension of
+        the subspace is doubled until it contains other eigenvalues than the cluster as well.
+        :param eig: Eigenvalue
+        :param m: Expected multiplicity
+        :param cluster_tol: Relative tolerance for eigenvalues to be treated as repeated
+        :return: Eigenvalues, right eigenvectors (state part, columns)
+        '''
+        n = self.ps.n_states
+        e, j = self.e_desc, self.j_desc
+        scale = max(1, abs(eig))
+        sigma = eig + 1e-3*cluster_tol*scale
+        lu = sp_linalg.splu(sp.csc_matrix(j - sigma*e, dtype=complex))
+
+        def in_cluster(mu):
+            return abs(sigma + 1/mu - eig) <= cluster_tol*scale
+
+        rng = np.random.default_rng(0)
+        m = min(m + 2, j.shape[0])
+        while True:
+            z = rng.standard_normal((j.shape[0], m)) + 1j*rng.standard_normal((j.shape[0], m))
+            for _ in range(3):
+                z, _ = np.linalg.qr(lu.solve(e.dot(z).astype(complex)))
+            # Rayleigh-Ritz on (j - sigma*e)^-1*e, the (orthonormal) Schur vectors of the cluster span its eigenspace
+            t, q, n_cluster = scipy.linalg.schur(z.conj().T.dot(lu.solve(e.dot(z).astype(complex))), output='complex',
+                                                 sort=in_cluster)
+            if n_cluster < m or m == j.shape[0]:
+                break
+            m = min(2*m, j.shape[0])
+        return sigma + 1/np.diag(t)[:n_cluster], z.dot(q[:, :n_cluster])[:n]
+
+    def spectral_radius_descriptor(self):
+        '''
+        Spectral radius of the state matrix a = f_x - f_v*j_vv^-1*r_x (i.e. the largest magnitude of the finite
+        eigenvalues of the descriptor system), by Arnoldi iterations using one sparse LU factorization of the network
+        equations j_vv, such that a is not formed.
+        '''
+        n = self.ps.n_states
+        j = self.j_desc.tocsr()
+        j_xx, j_xv, j_vx = j[:n, :n], j[:n, n:], j[n:, :n]
+        lu = sp_linalg.splu(sp.csc_matrix(j[n:, n:]))
+        op = sp_linalg.LinearOperator((n, n), matvec=lambda x: j_xx.dot(x) - j_xv.dot(lu.solve(j_vx.dot(x))),
+                                      dtype=float)
+        return max(abs(sp_linalg.eigs(op, k=1, which='LM', tol=1e-3, return_eigenvectors=False)))
 
     def eigenvalue_decomposition(self):
         if not self.linearization_ready:
             self.linearize()
 
-        self.eigs, evs = np.linalg.eig(self.a)
+        if self.descriptor:
+            # The dense state matrix is not available, only the electromechanical modes are computed
+            self.eigenvalue_decomposition_sparse()
+            return
 
-        # Right/left rigenvectors (rev/lev)
-        self.rev = evs
-        self.lev = np.linalg.inv(self.rev)
-        # self.damping = -self.eigs.real / abs(self.eigs)
-        self.damping = np.divide(
-            -self.eigs.real, abs(self.eigs),
-            out=np.zeros_like(self.eigs.real)*np.nan,
-            where=self.eigs.real != 0,
-        )
-        self.freq = self.eigs.imag / (2 * np.pi)
+        super().eigenvalue_decomposition()
+
+    def eigenvalue_decomposition_sparse(self, freq_range=[0.1, 3], damp_threshold=1, n_shifts=5, k=10, shifts=None):
+        '''
+        Computes only the modes with frequency within freq_range and damping below damp_threshold (as get_mode_idx with
+        mode_type=['em', 'non_conj']), by shift-invert Arnoldi iterations on the sparse descriptor system (see
+        eigs_descriptor), such that the dense state matrix is not needed.
+
+        The k eigenvalues closest to a shift are all the eigenvalues within the disc around the shift reaching the
+        farthest of them. The requested region (bounded by the damping threshold, and by the spectral radius of the
+        state matrix) is split in cells, and shifts are added until each cell is within such a disc: First the given
+        shifts, then shifts at the centres of the uncovered cells closest to the imaginary axis (such that the least
+        damped modes are found first). At each shift, k is doubled until the disc covers a new cell. Since repeated
+        eigenvalues are not necessarily all found by the Arnoldi iterations, the eigenspace of each selected mode is
+        finally computed (see eigenspace_descriptor).
 
+        The results replace eigs, rev, lev, damping and freq (sorted by damping), such that e.g. residues and
+        get_mode_idx work on the selected modes.
+        :param n_shifts: The cells have sides (omega_max - omega_min)/(2*n_shifts)
+        :param k: Initial number of eigenvalues computed at each shift
+        :param shifts: Shifts to start with (complex)
+        :return: Eigenvalues, right eigenvectors (columns), left eigenvectors (rows) and participation factors
+        '''
+        if self.j_desc is None:
+            self.linearize_descriptor(x0=getattr(self, 'x0', np.array([])))
+
+        def damping_of(eigs):
+            return np.divide(-eigs.real, abs(eigs), out=np.zeros_like(eigs.real)*np.nan, where=eigs.real != 0)
+
+        def in_range(eigs):
+            freq = eigs.imag/(2*np.pi)
+            return (freq > freq_range[0]) & (freq < freq_range[1]) & (damping_of(eigs) < damp_threshold)
+
+        # Requested region: omega_min < imag < omega_max and re_min < real < re_max, where damping < damp_threshold
+        # gives real > -omega*damp_threshold/sqrt(1 - damp_threshold^2), and there are no eigenvalues outside the
+        # spectral radius (with some margin, since it is estimated)
+        radius_max = 1.1*self.spectral_radius_descriptor()
+        omega_min, omega_max = 2*np.pi*np.array(freq_range)
+        if damp_threshold >= 1:
+            re_min = -radius_max
+        elif damp_threshold <= -1:
+            re_min = radius_max  # No modes
+        else:
+            re_min = min(-omega*damp_threshold/np.sqrt(1 - damp_threshold**2) for omega in [omega_min, omega_max])
+        re_min, re_max = max(re_min, -radius_max), radius_max
+
+        # Cells (corners)
+        h = (omega_max - omega_min)/(2*n_shifts)
+        n_re, n_im = max(int(np.ceil((re_max - re_min)/h)), 1), 2*n_shifts
+        re_edges, im_edges = np.linspace(re_min, re_max, n_re + 1), np.linspace(omega_min, omega_max, n_im + 1)
+        re_0, im_0 = [edges.ravel() for edges in np.meshgrid(re_edges[:-1], im_edges[:-1])]
+        re_1, im_1 = [edges.ravel() for edges in np.meshgrid(re_edges[1:], im_edges[1:])]
+        corners = np.array([re_0 + 1j*im_0, re_0 + 1j*im_1, re_1 + 1j*im_0, re_1 + 1j*im_1]).T
+        centres = corners.mean(axis=1)
+        # Cells outside the damping threshold or the spectral radius are not searched
+        nearest = np.clip(0, re_0, re_1) + 1j*np.clip(0, im_0, im_1)
+        covered = (re_1 <= re_min) | (abs(nearest) >= radius_max)
+
+        shifts = list(shifts) if shifts is not None else []
+        k_max = self.j_desc.shape[0] - 2
+
+        results = []
+        while len(shifts) > 0 or not np.all(covered):
+            if len(shifts) == 0:
+                uncovered = np.where(~covered)[0]
+                shifts.append(centres[uncovered[np.argmin(abs(centres[uncovered].real))]])
+            sigma = shifts.pop(0)
+            k_sigma = min(k, k_max)
+            while True:
+                try:
+                    eigs_sigma, rev_sigma = self.eigs_descriptor(sigma, k=k_sigma, tol=1e-8)
+                    radius = np.inf if k_sigma == k_max else max(abs(eigs_sigma - sigma))
+                except sp_linalg.ArpackNoConvergence:
+                    # E.g. eigenvalues with high multiplicity close to the shift, which need a larger Krylov subspace
+                    if k_sigma == k_max:
+                        raise
+                    radius = 0
+                # All eigenvalues closer to the shift than radius are found
+                covered_sigma = np.all(abs(corners - sigma) < radius, axis=1)
+                if np.any(covered_sigma & ~covered) or radius == np.inf:
+                    break
+                k_sigma = min(2*k_sigma, k_max)
+            covered |= covered_sigma
+            results.append((sigma, radius, eigs_sigma, rev_sigma))
+
+        # Modes found from several shifts are taken from the closest shift (which keeps repeated eigenvalues)
+        eigs, rev = [np.zeros(0, dtype=complex)], [np.zeros((self.n, 0), dtype=complex)]
+        for i, (sigma, radius, eigs_sigma, rev_sigma) in enumerate(results):
+            keep = in_range(eigs_sigma) & (abs(eigs_sigma - sigma) < radius)
+            for j, (sigma_other, radius_other, *_) in enumerate(results):
+                dist_other = abs(eigs_sigma - sigma_other)
+                closer = (dist_other < abs(eigs_sigma - sigma)) | ((dist_other == abs(eigs_sigma - sigma)) & (j < i))
+                keep &= ~((j != i) & closer & (dist_other < radius_other))
+            eigs.append(eigs_sigma[keep])
+            rev.append(rev_sigma[:, keep])
+        eigs, rev = np.concatenate(eigs), np.hstack(rev)
+
+        # Complete the clusters of repeated eigenvalues
+        eigs_found = eigs
+        eigs, rev = [np.zeros(0, dtype=complex)], [np.zeros((self.n, 0), dtype=complex)]
+        completed = np.zeros(len(eigs_found), dtype=bool)
+        for i, eig in enumerate(eigs_found):
+            if completed[i]:
+                continue
+            cluster = abs(eigs_found - eig) <= 1e-6*max(1, abs(eig))
+            eigs_c, rev_c = self.eigenspace_descriptor(eig, sum(cluster))
+            eigs.append(eigs_c)
+            rev.append(rev_c)
+            completed |= cluster
+        eigs, rev = np.concatenate(eigs), np.hstack(rev)
+
+        idx = np.argsort(damping_of(eigs))
+        self.eigs = eigs[idx]
+        self.rev = rev[:, idx]
+        self.lev = self.left_eigenvectors_descriptor(self.eigs, self.rev)
+        self.damping = damping_of(self.eigs)
+        self.freq = self.eigs.imag/(2*np.pi)
         self.eigenvalues_ready = True
+        return self.eigs, self.rev, self.lev, self.participation_factors()
+
+    def eigenvalue_sensitivity(self, parameter_description, mode_idx=None, eps_x=1e-6, eps_p=1e-4):
+        '''
+        Sensitivities of eigenvalues to model parameters, d(lambda_i)/dp = lev[i].dot(da/dp).dot(rev[:, i]), using the
+        eigenvectors from the last eigenvalue decomposition (such that the system is not linearized again). The product
+        (da/dp)*rev[:, i] is found by directional finite differences of the state derivatives, i.e. 8 evaluations of
+        ode_fun per mode and parameter. The operating point is assumed to be independent of the parameters.
+
+        Each parameter is given in "parameter_description" as ((category, mdl_key), par_name[, unit_name]). Parameters
+        of submodules (blocks) are given by their path, e.g. 'gain.K' for the gain of a PSS (the parameters of the
+        blocks are copied when the model is created). Without a unit name, the parameter is changed by the same amount
+        for all units of the model.
+        :param mode_idx: Indices of modes (default: all modes)
+        :param eps_x: Step length of the directional derivatives along the (normalized) eigenvectors
+        :param eps_p: Relative step length of the parameters
+        :return: Sensitivities (n_modes x n_parameters)
+        '''
+        if not self.eigenvalues_ready:
+            self.eigenvalue_decomposition()
+
+        ps = self.ps
+        x0 = getattr(self, 'x0', ps.x0)
+        mode_idx = np.arange(len(self.eigs)) if mode_idx is None else np.atleast_1d(mode_idx)
+
+        def a_dot(v):
+            # Product of the state matrix and the (complex) vector v
+            scale = np.linalg.norm(v)
+            a_v = []
+            for d in [v.real/scale, v.imag/scale]:
+                a_v.append((ps.ode_fun(0, x0 + eps_x*d) - ps.ode_fun(0, x0 - eps_x*d)) / (2 * eps_x) * scale)
+            return a_v[0] + 1j*a_v[1]
+
+        sensitivity = np.zeros((len(mode_idx), len(parameter_description)), dtype=complex)
+        for k, ((category, mdl_key), par_name, *unit_name) in enumerate(parameter_description):
+            mdl = ps.dyn_mdls_dict[category][mdl_key]
+            idx = utils.lookup_strings(unit_name[0], mdl.par['name']) if len(unit_name) > 0 else slice(None)
+            *submodules, par_name = par_name.split('.')
+            for submodule in submodules:
+                mdl = getattr(mdl, submodule)
+            par_0 = mdl.par[par_name][idx].copy()
+            delta = eps_p*max(np.max(abs(par_0)), 1)
+
+            a_v = []
+            par_perturbed = []
+            for sign in [1, -1]:
+                mdl.par[par_name][idx] = par_0 + sign*delta
+                par_perturbed.append(np.max(mdl.par[par_name][idx]))
+                a_v.append([a_dot(self.rev[:, i]) for i in mode_idx])
+            mdl.par[par_name][idx] = par_0
+
+            # The actual step, since parameters stored as integers are rounded
+            step = par_perturbed[0] - par_perturbed[1]
+            if step == 0:
+                raise ValueError('Parameter {} could not be perturbed.'.format(par_name))
+            for j, i in enumerate(mode_idx):
+                sensitivity[j, k] = self.lev[i].dot(a_v[0][j] - a_v[1][j]) / step
+
+        return sensitivity
 
     def linearize_inputs(self, input_description):
         # Perturbs values in PowerSystemModel-object, as indicated by "input_description", and computes
@@ -112,127 +957,350 @@ class PowerSystemModelLinearization:
         self.b = b
         return b
 
-    def linearize_outputs(self, output_description):
-        # Perturbs states in PowerSystemModel-object, as indicated by "output_description", and computes
-        # the output matrix (or vector) "c" from the change in output.
+    def linearize_inputs_v4(self, input_description, batched=True):
+        # Computes the input matrix "b" with respect to inputs of the models. Each input is given in
+        # "input_description" as ((category, mdl_key), input_name, unit_name[, gain]), as for input events (see
+        # src.events.EventQueue). With batched=True, inputs of units that do not affect the same states or network
+        # currents (see unit_dependencies) are perturbed in the same evaluation, and the network equations are
+        # eliminated afterwards (as in jacobian_sparse). Otherwise, each input is perturbed separately.
         ps = self.ps
         eps = self.eps
-        x = ps.x0.copy()
-        c = np.zeros((len(output_description), len(ps.x0)), dtype=complex)
-        for i, outp_ in enumerate(output_description):
-            c_tmp = np.zeros(ps.n_states, dtype=complex)
-            for j in range(ps.n_states):
-                for outp__ in outp_:
-                    var = outp__[0]
-                    index = outp__[1]
-                    gain = outp__[2] if len(outp__) == 3 else 1
-
-                    x_1 = x.copy()
-                    x_2 = x.copy()
-
-                    x_1[j] += eps
-                    x_2[j] -= eps
-
-                    ps.ode_fun(0, x_1)
-                    var_1 = getattr(ps, var)[index]
-                    ps.ode_fun(0, x_2)
-                    var_2 = getattr(ps, var)[index]
-
-                    c_tmp[j] += (var_1 - var_2)/(2*eps)*gain
-
-            c[i, :] = c_tmp
-        self.c = c
-        return c
+        t0 = 0
+        x0 = getattr(self, 'x0', ps.x0)
 
-    def linearize_outputs_v3(self, output_description):
-        # Perturbs states in PowerSystemModel-object, as indicated by "output_description", and computes
-        # the output matrix (or vector) "c" from the change in output.
+        inputs = []
+        for (category, mdl_key), input_name, unit_name, *gain in input_description:
+            mdl = ps.dyn_mdls_dict[category][mdl_key]
+            if isinstance(getattr(mdl, input_name), ConnectedInput):
+                print('Input {} of {} is connected to other models, and is not perturbed.'.format(input_name, mdl_key))
+            unit = utils.lookup_strings(unit_name, mdl.par['name'])
+            inputs.append((mdl, input_name, unit, gain[0] if len(gain) > 0 else 1))
+        values_0 = [mdl._input_values[input_name][unit] for mdl, input_name, unit, _ in inputs]
+
+        def set_inputs(du):
+            for (mdl, input_name, unit, _), value_0 in zip(inputs, values_0):
+                mdl._input_values[input_name][unit] = value_0
+            for (mdl, input_name, unit, gain), du_i in zip(inputs, du):
+                mdl._input_values[input_name][unit] += gain*du_i
+
+        if not batched:
+            b = np.zeros((len(x0), len(inputs)))
+            for i in range(len(inputs)):
+                du = np.zeros(len(inputs))
+                du[i] = eps
+                set_inputs(du)
+                f_1 = ps.ode_fun(t0, x0)
+                set_inputs(-du)
+                f_2 = ps.ode_fun(t0, x0)
+                b[:, i] = (f_1 - f_2) / (2 * eps)
+            set_inputs(np.zeros(len(inputs)))
+            self.b = b
+            return b
+
+        # Rows (states and network currents) affected by the input of each unit
+        units = self.unit_dependencies()
+        rows, cols = [], []
+        for i, (mdl, _, unit, _) in enumerate(inputs):
+            for key, deps in units['deps'].items():
+                if (id(mdl), unit) in deps:
+                    currents = list(units['currents'][key])
+                    rows_i = list(units['states'][key]) + [ps.n_states + bus for bus in currents] + \
+                        [ps.n_states + ps.n_bus_red + bus for bus in currents]
+                    rows += rows_i
+                    cols += [i]*len(rows_i)
+        sparsity = sp.csc_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                                 shape=(ps.n_states + 2*ps.n_bus_red, len(inputs)))
+
+        v0 = ps.solve_algebraic(t0, x0)
+
+        def f_u(du):
+            set_inputs(du)
+            return self.state_and_current_derivatives(t0, x0, v0)
+
+        jac_u = utils.jacobian_num_sparse(f_u, np.zeros(len(inputs)), sparsity, eps=eps).tocsr()
+        set_inputs(np.zeros(len(inputs)))
+        r_u = jac_u[ps.n_states:ps.n_states + ps.n_bus_red] + 1j*jac_u[ps.n_states + ps.n_bus_red:]
+
+        f_v_re, f_v_im = self.voltage_jacobians(t0, x0, v0)
+        self.b = self.eliminate_network(jac_u[:ps.n_states], r_u.tocsc(), f_v_re, f_v_im, self.admittance_matrix(t0, x0))
+        return self.b
+
+    def output_jacobian(self, outputs, dtype=float):
+        # Central differences of all outputs (outputs(x) returns them as one array) with respect to the states, with
+        # each state perturbed once (in each direction), and all outputs evaluated from the same perturbed solution.
         ps = self.ps
         eps = self.eps
         x = ps.x0.copy()
-        c = np.zeros((len(output_description), len(ps.x0)), dtype=complex)
-        for i, outp_ in enumerate(output_description):
-            c_tmp = np.zeros(ps.n_states, dtype=complex)
-            for j in range(ps.n_states):
-                x_1 = x.copy()
-                x_2 = x.copy()
-                x_1[j] += eps
-                x_2[j] -= eps
-
-                ps.ode_fun(0, x_1)
-                var_1 = outp_(ps)
-                ps.ode_fun(0, x_2)
-                var_2 = outp_(ps)
-
-                c_tmp[j] += (var_1 - var_2) / (2 * eps)
-            c[i, :] = c_tmp
-        self.c = c
+        c = np.zeros((len(outputs(x)), len(x)), dtype=dtype)
+        for j in range(len(x)):
+            x_1 = x.copy()
+            x_2 = x.copy()
+            x_1[j] += eps
+            x_2[j] -= eps
+            c[:, j] = (outputs(x_1) - outputs(x_2)) / (2 * eps)
         return c
 
-    def linearize_outputs_v4(self, output_description):
+    def linearize_outputs(self, output_description):
+        # Perturbs states in PowerSystemModel-object, and computes the output matrix (or vector) "c" from the change in
+        # the outputs indicated by "output_description".
+        ps = self.ps
+
+        def outputs(x):
+            ps.ode_fun(0, x)
+            return np.array([
+                sum(getattr(ps, outp__[0])[outp__[1]]*(outp__[2] if len(outp__) == 3 else 1) for outp__ in outp_)
+                for outp_ in output_description
+            ], dtype=complex)
 
+        self.c = self.output_jacobian(outputs, dtype=complex)
+        return self.c
+
+    def linearize_outputs_v3(self, output_description):
+        # Perturbs states in PowerSystemModel-object, and computes the output matrix (or vector) "c" from the change in
+        # the outputs given by the functions in "output_description".
+        ps = self.ps
+
+        def outputs(x):
+            ps.ode_fun(0, x)
+            return np.hstack([outp_(ps) for outp_ in output_description]).astype(complex)
+
+        self.c = self.output_jacobian(outputs, dtype=complex)
+        return self.c
+
+    def linearize_outputs_v4(self, output_description):
+        # Perturbs states in PowerSystemModel-object, and computes the output matrix (or vector) "c" from the change in
+        # the outputs given by the functions outp_(t, x, v) in "output_description". Functions returning arrays give
+        # one row for each element (in the order of output_description).
         ps = self.ps
-        eps = self.eps
         t = 0
-        x = ps.x0.copy()
-        v = ps.v0.copy()
 
-        dtypes = np.zeros(len(output_description), dtype=np.dtype)
-        for i, outp_ in enumerate(output_description):
-            dtypes[i] = np.dtype(outp_(t, x, v))
+        dtypes = [np.result_type(outp_(t, ps.x0.copy(), ps.v0.copy())) for outp_ in output_description]
 
-        if np.any(dtypes == 'complex128'):
+        if any(np.issubdtype(dtype, np.complexfloating) for dtype in dtypes):
             dtype_c = 'complex128'
         else:
             dtype_c = 'float64'
 
-        c = np.zeros((len(output_description), len(ps.x0)), dtype=dtype_c)
-        for i, outp_ in enumerate(output_description):
-            c_tmp = np.zeros(ps.n_states, dtype=dtype_c)
-            for j in range(ps.n_states):
-                x_1 = x.copy()
-                x_2 = x.copy()
-                x_1[j] += eps
-                x_2[j] -= eps
-
-                t_1 = t
-                t_2 = t
-
-                ps.ode_fun(0, x_1)
-                v_1 = ps.solve_algebraic(0, x_1)
-                var_1 = outp_(t_1, x_1, v_1)
-                ps.ode_fun(0, x_2)
-                v_2 = ps.solve_algebraic(0, x_2)
-                var_2 = outp_(t_2, x_2, v_2)
-
-                c_tmp[j] += (var_1 - var_2) / (2 * eps)
-            c[i, :] = c_tmp
-        self.c = c
-        return c
+        def outputs(x):
+            v = ps.solve_algebraic(t, x)
+            ps.state_derivatives(t, x, v)
+            return np.hstack([outp_(t, x, v) for outp_ in output_description]).astype(dtype_c)
 
-    def get_mode_idx(self, mode_type=['em', 'non_conj'], damp_threshold=1, freq_range=[0.1, 3], sorted=True):
-        # Get indices of modes from specified criteria.
-        eigs = self.eigs
-        idx = np.ones(len(eigs), dtype=bool)
-        if not isinstance(mode_type, list):
-            mode_type = [mode_type]
+        self.c = self.output_jacobian(outputs, dtype=dtype_c)
+        return self.c
 
-        for mt in mode_type:
-            if mt == 'em':
-                idx *= (abs(eigs.imag) / (2 * np.pi) > freq_range[0]) & (abs(eigs.imag) / (2 * np.pi) < freq_range[1])
-            if mt == 'non_conj':
-                idx *= eigs.imag >= 0
 
-        idx *= self.damping < damp_threshold
+def match_modes(track_eigs, track_rev, eigs, rev):
+    '''
+    Pairs modes with tracked modes (e.g. from the previous point of a parameter sweep), by minimizing the total cost
+    1 - mac + |eig - track_eig|/(1 + |track_eig|), where mac is the correlation between the right eigenvectors.
+    :return: Index of the tracked mode for each mode (-1 if not paired, when there are more modes than tracked modes)
+    '''
+    track_idx = -np.ones(len(eigs), dtype=int)
+    if len(track_eigs) == 0 or len(eigs) == 0:
+        return track_idx
+    mac = abs(track_rev.conj().T.dot(rev)) / np.outer(np.linalg.norm(track_rev, axis=0), np.linalg.norm(rev, axis=0))
+    cost = 1 - mac + abs(track_eigs[:, None] - eigs[None, :]) / (1 + abs(track_eigs[:, None]))
+    rows, cols = linear_sum_assignment(np.nan_to_num(cost, nan=np.inf, posinf=1e12))
+    track_idx[cols] = rows
+    return track_idx
 
-        idx = np.where(idx)[0]
-        if sorted:
-            idx = idx[np.argsort(self.damping[idx])]
-        return idx
 
-    def get_dominant_mode(self):
-        em_idx = (0.1 < self.freq) & (self.freq < 2)
-        return np.argmin(self.damping)
+class ModeTracks:
+    '''
+    Eigenvalues (and optionally participation factors) of consecutive points of a sweep, with the modes at each point
+    paired with the modes at the previous point (see match_modes). Modes which are not paired start new tracks.
+    '''
+    def __init__(self):
+        self.eigs = []
+        self.participation = []
+        self.track_eigs = np.zeros(0, dtype=complex)  # Last eigenvalue and right eigenvector of each track
+        self.track_rev = None
+        self.first_eigs = None  # Eigenvalues and right eigenvectors of the first point (in track order)
+        self.first_rev = None
+
+    @property
+    def n_tracks(self):
+        return len(self.track_eigs)
+
+    def assign(self, eigs, rev):
+        # Track index of each mode, and updates the last eigenvalue/eigenvector of the tracks
+        if self.track_rev is None:
+            self.track_rev = np.zeros((rev.shape[0], 0), dtype=complex)
+        track_idx = match_modes(self.track_eigs, self.track_rev, eigs, rev)
+        new = track_idx < 0
+        track_idx[new] = self.n_tracks + np.arange(sum(new))
+        self.track_eigs = np.concatenate([self.track_eigs, np.zeros(sum(new), dtype=complex)])
+        self.track_rev = np.hstack([self.track_rev, np.zeros((rev.shape[0], sum(new)), dtype=complex)])
+        self.track_eigs[track_idx] = eigs
+        self.track_rev[:, track_idx] = rev
+        return track_idx
+
+    def add(self, eigs, rev, participation=None):
+        track_idx = self.assign(eigs, rev)
+        self.eigs.append((track_idx, eigs))
+        self.participation.append((track_idx, participation))
+        if self.first_eigs is None:
+            self.first_eigs, self.first_rev = self.track_eigs.copy(), self.track_rev.copy()
+
+    def append(self, tracks):
+        # Appends the points of another ModeTracks-object (e.g. the next chunk of a sweep), by pairing its tracks at
+        # its first point with the tracks at the last point of this object
+        track_map = self.assign(tracks.first_eigs, tracks.first_rev)
+        for (track_idx, eigs), (_, participation) in zip(tracks.eigs, tracks.participation):
+            self.eigs.append((track_map[track_idx], eigs))
+            self.participation.append((track_map[track_idx], participation))
+        self.track_eigs[track_map] = tracks.track_eigs
+        self.track_rev[:, track_map] = tracks.track_rev
+
+    def to_array(self):
+        # Eigenvalues (n_points x n_tracks, nan if the track has no mode at a point) and list of participation factors
+        # (n_states x n_tracks) at each point
+        eigs = np.full((len(self.eigs), self.n_tracks), np.nan, dtype=complex)
+        participation = []
+        for i, ((track_idx, eigs_point), (_, participation_point)) in enumerate(zip(self.eigs, self.participation)):
+            eigs[i, track_idx] = eigs_point
+            if participation_point is not None:
+                participation_tracks = np.full((participation_point.shape[0], self.n_tracks), np.nan)
+                participation_tracks[:, track_idx] = participation_point
+                participation.append(participation_tracks)
+        return eigs, participation
+
+
+def _sweep_chunk(model, user_mdl_lib_name, options, set_parameter, values, snapshot_data, freq_range, damp_threshold,
+                 participation):
+    # Runs consecutive points of a parameter sweep (in a worker process). Without a snapshot of the initialized model
+    # (see PowerSystemModel.snapshot_data), the model is initialized at each point (the parameter affects the operating
+    # point).
+    user_mdl_lib = importlib.import_module(user_mdl_lib_name) if user_mdl_lib_name is not None else None
+    reinitialize = snapshot_data is None
+
+    def init_model(value, v_init=None):
+        if not reinitialize:
+            ps = dps.PowerSystemModel.from_snapshot_data(snapshot_data, user_mdl_lib)
+            set_parameter(ps, value)
+            return ps
+        ps = dps.PowerSystemModel(model, user_mdl_lib)
+        for key, option in options.items():
+            setattr(ps, key, option)
+        set_parameter(ps, value)
+        ps.pf_init = v_init
+        ps.init_dyn_sim()
+        return ps
+
+    tracks = ModeTracks()
+    ps = None
+    ps_lin = None
+    for value in values:
+        if ps is None or reinitialize:
+            # Warm start: The power flow starts from the operating point of the previous point
+            ps = init_model(value, ps.v_0 if ps is not None else None)
+            ps_lin = PowerSystemModelLinearization(ps)
+            ps_lin.descriptor = freq_range is not None
+        else:
+            set_parameter(ps, value)
+
+        ps_lin.linearize()
+        if freq_range is None:
+            ps_lin.eigenvalue_decomposition()
+        else:
+            ps_lin.eigenvalue_decomposition_sparse(freq_range, damp_threshold)
+        tracks.add(ps_lin.eigs, ps_lin.rev, abs(ps_lin.participation_factors()) if participation else None)
+
+    return tracks
+
+
+class ParameterSweep:
+    def __init__(self, model, set_parameter, values, reinitialize=False, freq_range=None, damp_threshold=1,
+                 participation=False, max_workers=None, user_mdl_lib=None, options=None):
+        '''
+        Eigenvalues of the linearized system for a sweep of a parameter. The sweep points are split in consecutive
+        chunks, which are computed in parallel by a pool of processes. If the parameter does not change the operating
+        point, the model is initialized once (in this process), and each worker restores a snapshot of it (see
+        PowerSystemModel.snapshot_data) and re-linearizes it at each point. Otherwise (reinitialize=True), each worker
+        builds its own model and initializes it at each point, with the power flow starting from the solution at the
+        previous point. Modes are paired between consecutive points (see match_modes), such that each column of eigs
+        is the trajectory of one mode.
+
+        Example:
+            def set_inertia(ps, value):
+                ps.gen['GEN'].par['H'] = value
+
+            sweep = ParameterSweep(model, set_inertia, np.linspace(3, 10, 200))
+            eigs = sweep.run()
+        :param model: Model data (dict)
+        :param set_parameter: Function set_parameter(ps, value), setting the parameter in a PowerSystemModel (must be
+        defined at module level, such that it can be sent to the worker processes)
+        :param values: Parameter values
+        :param reinitialize: Set to True if the parameter affects the operating point (power flow/initialization). The
+        parameter is then set before initializing the model at each point.
+        :param freq_range: If given, only the modes within freq_range and with damping below damp_threshold are
+        computed, with the sparse solver (see eigenvalue_decomposition_sparse)
+        :param participation: Also store the participation factors (abs) at each point
+        :param max_workers: Number of processes (default: number of processors, 1 runs the sweep in this process)
+        :param user_mdl_lib: Module with user models (imported by name in each worker)
+        :param options: Attributes set on PowerSystemModel before initialization
+        '''
+        self.model = model
+        self.set_parameter = set_parameter
+        self.values = np.asarray(values)
+        self.reinitialize = reinitialize
+        self.freq_range = freq_range
+        self.damp_threshold = damp_threshold
+        self.participation = participation
+        self.max_workers = max_workers
+        self.user_mdl_lib = user_mdl_lib
+        self.options = options if options is not None else {}
+
+        self.eigs = None
+        self.participation_factors = None
+        self.damping = None
+        self.freq = None
+
+    def run(self):
+        '''
+        Runs the sweep.
+        :return: Eigenvalues (n_values x n_tracks), nan where a tracked mode is not found at a point
+        '''
+        user_mdl_lib_name = self.user_mdl_lib.__name__ if self.user_mdl_lib is not None else None
+        args = (self.model, user_mdl_lib_name, self.options, self.set_parameter)
+
+        # If the operating point does not depend on the parameter, the model is initialized once, and all workers
+        # start from a snapshot of the initialized model (which can be sent to the workers, see snapshot_data)
+        snapshot_data = None
+        if not self.reinitialize:
+            ps = dps.PowerSystemModel(self.model, self.user_mdl_lib)
+            for key, option in self.options.items():
+                setattr(ps, key, option)
+            ps.init_dyn_sim()
+            snapshot_data = ps.snapshot_data()
+            snapshot_data['settings'].update(self.options)
+
+        kwargs = dict(snapshot_data=snapshot_data, freq_range=self.freq_range, damp_threshold=self.damp_threshold,
+                      participation=self.participation)
+
+        if self.max_workers == 1:
+            chunks = [_sweep_chunk(*args, self.values, **kwargs)]
+        else:
+            n_chunks = min(self.max_workers or os.cpu_count(), len(self.values))
+            with ProcessPoolExecutor(max_workers=n_chunks) as executor:
+                futures = [executor.submit(_sweep_chunk, *args, values, **kwargs)
+                           for values in np.array_split(self.values, n_chunks)]
+                chunks = [future.result() for future in futures]
+
+        tracks = chunks[0]
+        for chunk in chunks[1:]:
+            tracks.append(chunk)
+
+        self.eigs, participation = tracks.to_array()
+        self.participation_factors = participation if self.participation else None
+        self.freq = self.eigs.imag / (2 * np.pi)
+        self.damping = np.divide(
+            -self.eigs.real, abs(self.eigs),
+            out=np.zeros_like(self.eigs.real)*np.nan,
+            where=self.eigs.real != 0,
+        )
+        return self.eigs
 
 
 if __name__ == '__main__':
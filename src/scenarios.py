@@ -0,0 +1,211 @@
+import numpy as np
+import importlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import src.dynamic as dps
+import src.solvers as dps_sol
+from src.events import EventQueue
+
+
+def scenario_name(name, scenario):
+    return '{}:{}'.format(name, scenario)
+
+
+def replicate_model(model, n_scenarios):
+    '''
+    Returns model data (dict) with n_scenarios identical and electrically separate copies of the system. All names
+    (of buses and models) are renamed using scenario_name, and so are all references to these names (e.g. the bus of a
+    generator, or the generator of an AVR). Units are ordered by scenario, such that unit i of scenario k is unit
+    k*n_units + i of each model.
+    :param model: Model data (dict)
+    :param n_scenarios: Number of copies
+    :return: Model data of the replicated system
+    '''
+    def tables(data):
+        for key, val in data.items():
+            if isinstance(val, dict):
+                for mdl_key, table in val.items():
+                    yield table
+            elif isinstance(val, list) and len(val) > 0 and isinstance(val[0], list):
+                yield val
+
+    names = set()
+    for table in tables(model):
+        if 'name' in table[0]:
+            name_col = table[0].index('name')
+            names.update(row[name_col] for row in table[1:])
+
+    def replicate_table(table):
+        header = table[0]
+        rows = []
+        for scenario in range(n_scenarios):
+            for row in table[1:]:
+                rows.append([
+                    scenario_name(val, scenario) if col == 'name' or (isinstance(val, str) and val in names) else val
+                    for col, val in zip(header, row)
+                ])
+        return [header] + rows
+
+    model_rep = {}
+    for key, val in model.items():
+        if isinstance(val, dict):
+            model_rep[key] = {mdl_key: replicate_table(table) for mdl_key, table in val.items()}
+        elif isinstance(val, list) and len(val) > 0 and isinstance(val[0], list):
+            model_rep[key] = replicate_table(val)
+        else:
+            model_rep[key] = val
+
+    if model.get('slack_bus'):
+        # Each copy is a separate island, and needs its own slack bus
+        model_rep['slack_bus'] = [scenario_name(model['slack_bus'], scenario) for scenario in range(n_scenarios)]
+
+    return model_rep
+
+
+class MultiScenarioModel(dps.PowerSystemModel):
+    def __init__(self, model, n_scenarios, user_mdl_lib=None):
+        '''
+        Power system model for simulating many scenarios (e.g. contingencies) in one run. The system is replicated
+        n_scenarios times (see replicate_model), so that state_derivatives and solve_algebraic evaluate all scenarios
+        in one vectorized pass (each model is evaluated once, with n_scenarios times as many units). Since the copies
+        are electrically separate, the network is block diagonal, and events (e.g. faults via y_bus_red_mod or
+        Line.event) applied to one scenario do not affect the others.
+
+        The states and voltages of each scenario are found with scenario_states and scenario_voltages, which return
+        arrays of shape (n_scenarios, n_states) and (n_scenarios, n_bus_red).
+        :param model: Model data (dict) of one scenario
+        :param n_scenarios: Number of scenarios
+        '''
+        if not model.get('slack_bus'):
+            model = model.copy()
+            ps = dps.PowerSystemModel(model, user_mdl_lib)
+            ps.setup()
+            bus_idx = ps.mdl_instructions['load_flow_pv'][0].load_flow_pv()[0]
+            model['slack_bus'] = ps.buses['name'][bus_idx[0]]
+
+        self.n_scenarios = n_scenarios
+        self.scenario_model = model
+        super().__init__(replicate_model(model, n_scenarios), user_mdl_lib)
+        self.sparse_y_bus = True
+
+    def scenario_name(self, name, scenario):
+        '''Returns the name of a bus or model (e.g. a line to be disconnected with Line.event) in a scenario.'''
+        return scenario_name(name, scenario)
+
+    def setup(self):
+        super().setup()
+        n_bus = self.n_bus // self.n_scenarios
+        bus_idx_red_map = -np.ones(self.n_bus, dtype=int)
+        bus_idx_red_map[self.bus_idx_red] = np.arange(self.n_bus_red)
+        self.scenario_bus_idx = np.arange(self.n_bus).reshape(self.n_scenarios, n_bus)
+        self.scenario_bus_idx_red = bus_idx_red_map[self.scenario_bus_idx[:, np.isin(self.scenario_bus_idx[0], self.bus_idx_red)]]
+
+    def snapshot_data(self):
+        # The model is recreated from the data of one scenario (see constructor_kwargs)
+        data = super().snapshot_data()
+        data['model'] = self.scenario_model
+        return data
+
+    def constructor_kwargs(self):
+        return {'n_scenarios': self.n_scenarios}
+
+    def init_dyn_sim(self, snapshot=None):
+        super().init_dyn_sim(snapshot)
+        scenario_state_idx = [[] for _ in range(self.n_scenarios)]
+        for mdl in self.dyn_mdls:
+            n_states = mdl.idx.stop - mdl.idx.start
+            if n_states > 0:
+                n_states_scenario = n_states // self.n_scenarios
+                for scenario in range(self.n_scenarios):
+                    start = mdl.idx.start + scenario*n_states_scenario
+                    scenario_state_idx[scenario].append(np.arange(start, start + n_states_scenario))
+        self.scenario_state_idx = np.array([np.concatenate(idx) for idx in scenario_state_idx], dtype=int)
+
+    def scenario_states(self, x):
+        return x[self.scenario_state_idx]
+
+    def scenario_voltages(self, v):
+        return v[self.scenario_bus_idx_red]
+
+
+def simulate_scenario(ps, events, t_end, solver=dps_sol.ModifiedEulerDAE, max_step=None, **solver_kwargs):
+    '''
+    Simulates one scenario from the initial state (ps.x_0) of an initialized model.
+    :param events: List of events (see src.events.EventQueue)
+    :return: dict with time, states and (reduced system) voltages at each time step
+    '''
+    if max_step is not None:
+        solver_kwargs['max_step'] = max_step
+
+    event_queue = EventQueue(ps, events)
+    sol = solver(ps.state_derivatives, ps.solve_algebraic, 0, ps.x_0.copy(), t_end, events=event_queue, **solver_kwargs)
+    res = {'t': [sol.t], 'x': [sol.x.copy()], 'v': [sol.v.copy()]}
+    while sol.t < t_end:
+        sol.step()
+        res['t'].append(sol.t)
+        res['x'].append(sol.x.copy())
+        res['v'].append(sol.v.copy())
+
+    return {key: np.array(val) for key, val in res.items()}
+
+
+_worker_ps = None
+_worker_snapshot = None
+
+
+def _init_worker(snapshot_data, user_mdl_lib_name):
+    global _worker_ps, _worker_snapshot
+    user_mdl_lib = importlib.import_module(user_mdl_lib_name) if user_mdl_lib_name is not None else None
+    ps = dps.PowerSystemModel.from_snapshot_data(snapshot_data, user_mdl_lib)
+
+    _worker_ps = ps
+    _worker_snapshot = ps.snapshot()
+
+
+def _run_worker_scenario(events, t_end, solver, max_step, solver_kwargs):
+    _worker_ps.restore(_worker_snapshot)
+    return simulate_scenario(_worker_ps, events, t_end, solver, max_step, **solver_kwargs)
+
+
+def run_contingencies(model, scenarios, t_end, solver=dps_sol.ModifiedEulerDAE, max_step=None, max_workers=None,
+                      user_mdl_lib=None, options=None, **solver_kwargs):
+    '''
+    Simulates a list of scenarios in parallel with a pool of processes. The model is initialized once (in the calling
+    process), and each worker recreates the initialized model from its snapshot (see PowerSystemModel.snapshot_data),
+    such that all scenarios start from the same initial state regardless of which worker runs them. The snapshot is
+    restored between scenarios. Results are yielded as each scenario finishes (not necessarily in the order of the
+    scenarios).
+
+    Example:
+        scenarios = [
+            [(1, 'fault', 'B1', 1e6), (1.05, 'fault', 'B1', 0)],
+            [(1, 'line', 'L7-8-1', 'disconnect')],
+        ]
+        for scenario_idx, res in run_contingencies(model, scenarios, t_end=10):
+            ...
+    :param model: Model data (dict)
+    :param scenarios: List of scenarios, each being a list of events (see src.events.EventQueue)
+    :param t_end: Simulation time
+    :param solver: Solver class (taking state derivatives and algebraic equations, e.g. ModifiedEulerDAE)
+    :param max_step: Time step (or maximum step size) passed to solver
+    :param max_workers: Number of processes (default: number of processors)
+    :param user_mdl_lib: Module with user models (imported by name in each worker)
+    :param options: Attributes set on PowerSystemModel before initialization, e.g. {'perform_kron_reduction': True}
+    :return: Generator of (scenario index, results of simulate_scenario)
+    '''
+    user_mdl_lib_name = user_mdl_lib.__name__ if user_mdl_lib is not None else None
+    options = options if options is not None else {}
+    ps = dps.PowerSystemModel(model, user_mdl_lib)
+    for key, value in options.items():
+        setattr(ps, key, value)
+    ps.init_dyn_sim()
+    snapshot_data = ps.snapshot_data()
+    snapshot_data['settings'].update(options)
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(snapshot_data, user_mdl_lib_name)) as executor:
+        futures = {
+            executor.submit(_run_worker_scenario, events, t_end, solver, max_step, solver_kwargs): scenario_idx
+            for scenario_idx, events in enumerate(scenarios)
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
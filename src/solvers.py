@@ -1,23 +1,43 @@
 import numpy as np
+import warnings
+import scipy.linalg as linalg
+from math import factorial
 
 
 class Euler:
-    def __init__(self, f, t0, x0, t_end, dt=5e-3, **kwargs):
+    def __init__(self, f, t0, x0, t_end, dt=5e-3, events=None, **kwargs):
         self.f = f
         self.t = t0
         self.x = x0.copy()
         self.y = self.x
         self.t_end = t_end
         self.dt = dt
+        self.events = events  # Event queue (see src.events.EventQueue), applied at the start of each step
 
         for key, value in kwargs.items():
             if key == 'max_step':
                 self.dt = value
 
+    def step_size(self):
+        # Size of next step, shortened such that steps end exactly at event times
+        if self.events is None:
+            return self.dt
+        return min(self.dt, self.events.next_time(self.t) - self.t)
+
+    def apply_events(self):
+        if self.events is not None and self.events.apply(self.t):
+            self.reset()
+
+    def reset(self):
+        '''Called after the system is changed by events.'''
+        pass
+
     def step(self):
         if self.t < self.t_end:
-            self.x[:] = self.x + self.f(self.t, self.x)*self.dt
-            self.t += self.dt
+            self.apply_events()
+            dt = self.step_size()
+            self.x[:] = self.x + self.f(self.t, self.x)*dt
+            self.t += dt
 
 
 class EulerDAE(Euler):
@@ -35,10 +55,16 @@ class EulerDAE(Euler):
         self.g_inv = g_inv
         self.v = self.g_inv(self.t, self.x)
 
+    def reset(self):
+        # The algebraic variables change instantaneously when the system is changed
+        self.v[:] = self.g_inv(self.t, self.x)
+
     def step(self):
         if self.t < self.t_end:
-            self.x[:] = self.x + self.f(self.t, self.x, self.v) * self.dt
-            self.t += self.dt
+            self.apply_events()
+            dt = self.step_size()
+            self.x[:] = self.x + self.f(self.t, self.x, self.v) * dt
+            self.t += dt
             self.v[:] = self.g_inv(self.t, self.x)
 
         else:
@@ -52,15 +78,17 @@ class ModifiedEuler(Euler):
 
     def step(self):
         if self.t < self.t_end:
+            self.apply_events()
+            dt = self.step_size()
             dxdt_0 = self.f(self.t, self.x)
-            x_1 = self.x + dxdt_0*self.dt
+            x_1 = self.x + dxdt_0*dt
             for _ in range(self.n_it):
-                dxdt_1 = self.f(self.t + self.dt, x_1)
+                dxdt_1 = self.f(self.t + dt, x_1)
                 dxdt_est = (dxdt_0 + dxdt_1) / 2
-                x_1 = self.x + dxdt_est*self.dt
+                x_1 = self.x + dxdt_est*dt
 
             self.x[:] = x_1
-            self.t += self.dt
+            self.t += dt
 
         else:
             print('End of simulation time reached.')
@@ -74,16 +102,18 @@ class ModifiedEulerDAE(EulerDAE):
 
     def step(self):
         if self.t < self.t_end:
+            self.apply_events()
+            dt = self.step_size()
             dxdt_0 = self.f(self.t, self.x, self.v)
-            x_1 = self.x + dxdt_0*self.dt
+            x_1 = self.x + dxdt_0*dt
             for _ in range(self.n_it):
-                dxdt_1 = self.f_ode(self.t + self.dt, x_1)
+                dxdt_1 = self.f_ode(self.t + dt, x_1)
                 dxdt_est = (dxdt_0 + dxdt_1) / 2
-                x_1 = self.x + dxdt_est*self.dt
+                x_1 = self.x + dxdt_est*dt
 
             self.x[:] = x_1
             self.v[:] = self.g_inv(self.t, self.x)
-            self.t += self.dt
+            self.t += dt
 
         else:
             print('End of simulation time reached.')
@@ -94,11 +124,12 @@ class SimpleRK4(Euler):
         super().__init__(*args, **kwargs)
 
     def step(self):
-        x = self.x
-        t = self.t
-        dt = self.dt
+        if self.t < self.t_end:
+            self.apply_events()
+            x = self.x
+            t = self.t
+            dt = self.step_size()
 
-        if t < self.t_end:
             k_1 = self.f(t, x)
             k_2 = self.f(t + dt / 2, x + (dt / 2) * k_1)
             k_3 = self.f(t + dt / 2, x + (dt / 2) * k_2)
@@ -110,3 +141,428 @@ class SimpleRK4(Euler):
             print('End of simulation time reached.')
 
 
+class EmbeddedRKDAE(EulerDAE):
+    def __init__(self, f, g_inv, t0, x0, t_end, rtol=1e-3, atol=1e-6, first_step=1e-3, min_step=1e-8,
+                 max_step=np.inf, **kwargs):
+        '''
+        Explicit embedded Runge-Kutta solver with variable step size, for systems where the algebraic equations are
+        solved in each stage (similar to ModifiedEulerDAE). The local error is estimated from the difference between
+        the solutions of two orders, and the step size is adapted such that the (weighted RMS) error is within the
+        tolerances. The Butcher tableau is specified by subclasses.
+
+        The solver does not step past the times of pending events (see EventQueue) or t_end, and the step size is
+        reset to first_step after events are applied. If the system is changed between steps otherwise, reset()
+        should be called before the next step.
+        :param rtol: Relative tolerance
+        :param atol: Absolute tolerance
+        :param first_step: Initial step size, and step size after events.
+        :param min_step: Steps are accepted regardless of the error estimate if the step size is below this value.
+        :param max_step: Maximum step size.
+        '''
+        super().__init__(f, g_inv, t0, x0, t_end, dt=first_step, **kwargs)
+        self.rtol = rtol
+        self.atol = atol
+        self.first_step = first_step
+        self.min_step = min_step
+        self.max_step = max_step
+
+        self.dt = first_step  # Proposed size of next step
+        self.dt_last = 0  # Size of last accepted step
+        self.n_accepted = 0
+        self.n_rejected = 0
+
+        self.a = np.array([np.pad(row, (0, len(self.c) - len(row))) for row in self.a])
+        self.fsal = np.allclose(self.a[-1], self.b) and self.c[-1] == 1
+        self.dxdt = None
+
+    def reset(self):
+        '''Discards derivatives from the previous step, to be called if the system is changed between steps.'''
+        self.dxdt = None
+        self.dt = self.first_step
+
+    def next_stop(self):
+        t_stop = self.t_end
+        if self.events is not None:
+            t_stop = min(t_stop, self.events.next_time(self.t))
+        return t_stop
+
+    def step(self):
+        if self.t < self.t_end:
+            self.apply_events()
+            if self.dxdt is None:
+                self.v[:] = self.g_inv(self.t, self.x)
+                self.dxdt = self.f(self.t, self.x, self.v)
+
+            t = self.t
+            x = self.x
+            k = np.zeros((len(self.c), len(x)))
+            k[0] = self.dxdt
+            t_stop = self.next_stop()
+            while True:
+                dt = min(self.dt, self.max_step)
+                stop = t + dt >= t_stop - 1e-12
+                if stop:
+                    dt = t_stop - t
+
+                for i in range(1, len(self.c)):
+                    x_i = x + dt*(self.a[i, :i] @ k[:i])
+                    v_i = self.g_inv(t + self.c[i]*dt, x_i)
+                    k[i] = self.f(t + self.c[i]*dt, x_i, v_i)
+
+                if self.fsal:
+                    x_1 = x_i
+                    v_1 = v_i
+                else:
+                    x_1 = x + dt*(self.b @ k)
+                    v_1 = None
+
+                scale = self.atol + self.rtol*np.maximum(abs(x), abs(x_1))
+                err = np.sqrt(np.mean((dt*(self.b_err @ k)/scale)**2))
+                factor = 0.9*err**(-1/(self.order + 1)) if err > 0 else 5
+                if err <= 1 or dt <= self.min_step:
+                    break
+
+                self.n_rejected += 1
+                self.dt = max(dt*max(0.2, factor), self.min_step)
+
+            self.x[:] = x_1
+            self.t = t_stop if stop else t + dt
+            self.dt_last = dt
+            self.n_accepted += 1
+            if stop and self.t < self.t_end:
+                self.reset()
+                self.v[:] = self.g_inv(self.t, self.x)
+            else:
+                if not stop:
+                    self.dt = dt*min(5, max(0.2, factor))
+                if self.fsal:
+                    self.v[:] = v_1
+                    self.dxdt = k[-1].copy()
+                else:
+                    self.v[:] = self.g_inv(self.t, self.x)
+                    self.dxdt = self.f(self.t, self.x, self.v)
+
+        else:
+            print('End of simulation time reached.')
+
+
+class BogackiShampineDAE(EmbeddedRKDAE):
+    '''Embedded Runge-Kutta solver of order 3(2) (Bogacki-Shampine), with variable step size.'''
+    c = np.array([0, 1/2, 3/4, 1])
+    a = [[], [1/2], [0, 3/4], [2/9, 1/3, 4/9]]
+    b = np.array([2/9, 1/3, 4/9, 0])
+    b_err = b - np.array([7/24, 1/4, 1/3, 1/8])
+    order = 2
+
+
+class DormandPrinceDAE(EmbeddedRKDAE):
+    '''Embedded Runge-Kutta solver of order 5(4) (Dormand-Prince), with variable step size.'''
+    c = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+    a = [
+        [],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84],
+    ]
+    b = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+    b_err = b - np.array([5179/57600, 0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40])
+    order = 4
+
+
+class ImplicitDAE(EulerDAE):
+    def __init__(self, f, g_inv, *args, tol=1e-6, max_it=10, max_backtrack=4, eps=1e-6, min_step=1e-4, **kwargs):
+        '''
+        Base class for implicit solvers (with fixed step size, except BDFDAE). The states at the end of each step are
+        found by solving x_1 - c*f(t_1, x_1, v_1) = b with a Newton iteration, where the algebraic equations
+        v_1 = g_inv(t_1, x_1) are solved in each iteration (the current injections only depend on the states, so this is a linear solve).
+        The Jacobian of the full system (with the network eliminated) is computed numerically and reused across
+        iterations and steps for as long as the iteration converges. It is only recomputed when convergence fails, so
+        that stiff systems can be simulated with long steps at a low cost.
+
+        If the iteration does not converge with a new Jacobian, the step is rejected and subdivided into two steps of
+        half the length (with a warning). Steps that do not converge at min_step are taken with the explicit
+        trapezoidal rule (as ModifiedEulerDAE), since the implicit equations might have no solution at discontinuities
+        (e.g. where limiters clamp the state derivatives). A RuntimeError is raised if this gives non-finite states.
+        :param tol: Tolerance of Newton iteration (scaled by 1 + |x|)
+        :param max_it: Maximum number of Newton iterations in each attempt
+        :param max_backtrack: Maximum number of times the Newton step is halved if the residual is not reduced
+        :param eps: Perturbation used for the numerical Jacobian
+        :param min_step: Minimum step size of the implicit method when subdividing steps
+        '''
+        super().__init__(f, g_inv, *args, **kwargs)
+        self.tol = tol
+        self.max_it = max_it
+        self.max_backtrack = max_backtrack
+        self.eps = eps
+        self.min_step = min_step
+
+        self.jac = None
+        self.jac_fresh = False
+        self.n_jac = 0  # Number of Jacobian evaluations
+        self.n_rejected = 0  # Number of rejected (subdivided) steps
+        self.n_explicit = 0  # Number of explicit steps (see advance)
+        self.iteration_matrix = None
+        self.iteration_matrix_c = None
+
+    def f_ode(self, t, x):
+        return self.f(t, x, self.g_inv(t, x))
+
+    def update_jacobian(self, t, x):
+        f_0 = self.f_ode(t, x)
+        self.jac = np.zeros((len(x), len(x)))
+        for i in range(len(x)):
+            x_i = x.copy()
+            dx = self.eps*max(1, abs(x[i]))
+            x_i[i] += dx
+            self.jac[:, i] = (self.f_ode(t, x_i) - f_0)/dx
+        self.jac_fresh = True
+        self.iteration_matrix = None
+        self.n_jac += 1
+
+    def solve_implicit(self, t, x_pred, c, b):
+        '''Returns the solution of x - c*f(t, x) = b, or None if the iteration does not converge.'''
+        if self.jac is None:
+            self.update_jacobian(t, x_pred)
+
+        while True:
+            # The iteration matrix is reused if c is changed slightly (e.g. by the variable step size of BDFDAE)
+            if self.iteration_matrix is None or abs(c/self.iteration_matrix_c - 1) > 0.2:
+                self.iteration_matrix = linalg.lu_factor(np.eye(len(x_pred)) - c*self.jac)
+                self.iteration_matrix_c = c
+
+            x = x_pred.copy()
+            r = x - c*self.f_ode(t, x) - b
+            err_prev = np.inf
+            for _ in range(self.max_it):
+                dx = linalg.lu_solve(self.iteration_matrix, r)
+                err = np.max(abs(dx)/(1 + abs(x)))
+
+                # Backtracking, since discontinuities (e.g. limiters) can make the full Newton step cycle
+                step = 1
+                for _ in range(self.max_backtrack + 1):
+                    x_new = x - step*dx
+                    r_new = x_new - c*self.f_ode(t, x_new) - b
+                    if np.linalg.norm(r_new) < np.linalg.norm(r):
+                        break
+                    step /= 2
+                x, r = x_new, r_new
+
+                if err < self.tol and np.all(np.isfinite(x)):
+                    self.jac_fresh = False
+                    return x
+                if not err < 0.9*err_prev or not np.all(np.isfinite(r)):
+                    break
+                err_prev = err
+
+            if self.jac_fresh:
+                self.jac_fresh = False
+                return None
+
+            self.update_jacobian(t, x_pred)
+
+    def implicit_step(self, dt):
+        '''States after a step of length dt from the current states, or None if the step failed.'''
+        raise NotImplementedError
+
+    def accept_step(self, dt):
+        '''Called when a step is accepted, before the states are updated.'''
+        pass
+
+    def explicit_step(self, dt):
+        '''States after a step of length dt with the explicit trapezoidal rule (used if the iteration fails).'''
+        warnings.warn('Newton iteration did not converge at t={:.4f}, explicit step is used.'.format(self.t + dt))
+        self.n_explicit += 1
+        dxdt_0 = self.f(self.t, self.x, self.v)
+        x_p = self.x + dxdt_0*dt
+        x_1 = self.x + (dxdt_0 + self.f_ode(self.t + dt, x_p))*dt/2
+        if not np.all(np.isfinite(x_1)):
+            raise RuntimeError('Non-finite states at t={:.4f}.'.format(self.t + dt))
+        return x_1
+
+    def advance(self, dt):
+        self.v[:] = self.g_inv(self.t, self.x)  # Network might have changed since end of last step
+        x_1 = self.implicit_step(dt)
+        if x_1 is None and dt/2 >= self.min_step:
+            warnings.warn('Newton iteration did not converge at t={:.4f}, step size is reduced to {:.2e}.'.format(
+                self.t + dt, dt/2))
+            self.n_rejected += 1
+            t_1 = self.t + dt
+            self.advance(dt/2)
+            self.advance(t_1 - self.t)
+            return
+
+        if x_1 is None:
+            x_1 = self.explicit_step(dt)
+
+        self.accept_step(dt)
+        self.t += dt
+        self.x[:] = x_1
+        self.v[:] = self.g_inv(self.t, self.x)
+
+    def step(self):
+        if self.t < self.t_end:
+            self.apply_events()
+            self.advance(self.step_size())
+
+        else:
+            print('End of simulation time reached.')
+
+
+class TrapezoidalDAE(ImplicitDAE):
+    '''
+    Implicit trapezoidal rule (A-stable, no numerical damping of oscillatory modes).
+    '''
+    def implicit_step(self, dt):
+        dxdt_0 = self.f(self.t, self.x, self.v)
+        return self.solve_implicit(self.t + dt, self.x.copy(), dt/2, self.x + dxdt_0*dt/2)
+
+
+class BDFDAE(ImplicitDAE):
+    # Coefficients of the derivative in the formulas of order 1-5 with constant step size (the local error of order q
+    # is beta[q - 1]/(q + 1)*dt**(q + 1) times the (q + 1)th derivative of the states)
+    beta = [1, 2/3, 6/11, 12/25, 60/137]
+
+    def __init__(self, *args, rtol=1e-3, atol=1e-6, first_step=1e-3, max_order=5, **kwargs):
+        '''
+        Backward differentiation formulas with variable order (1-5) and variable step size. The coefficients are
+        computed from the times of the previous steps, so that the history is kept when the step size changes. The
+        local errors of orders order-1, order and order+1 are estimated from divided differences of the states of the
+        previous steps. Steps where the (weighted RMS) error of the current order exceeds the tolerances are rejected,
+        and after order+1 steps with the same order, the order which allows the longest next step is selected. The
+        step size is limited by max_step, and steps end exactly at event times.
+
+        The history is discarded by reset(), which is called after events (see EventQueue), and which should be called
+        if the system is changed between steps otherwise. The solver then restarts with an implicit Euler step of
+        length first_step. Orders above 2 are not A-stable, so max_order can be reduced if lightly damped modes are
+        amplified.
+        :param rtol: Relative tolerance
+        :param atol: Absolute tolerance
+        :param first_step: Initial step size, and step size after reset()
+        :param max_order: Maximum order (1-5)
+        '''
+        super().__init__(*args, **kwargs)
+        self.rtol = rtol
+        self.atol = atol
+        self.first_step = first_step
+        self.max_order = max_order
+        self.max_step = self.dt
+
+        self.dt = min(first_step, self.max_step)  # Proposed size of next step
+        self.order = 1
+        self.n_equal = 0  # Number of steps since the order was changed
+        self.history = []  # States of previous steps (latest first)
+        self.history_t = []  # Times of previous steps
+        self.dxdt = None  # Derivatives at the first point of the history (for the error of the first step)
+        self.n_accepted = 0
+
+    def reset(self):
+        super().reset()
+        self.history = []
+        self.history_t = []
+        self.dt = min(self.first_step, self.max_step)
+
+    @staticmethod
+    def divided_difference(ts, xs):
+        # Divided difference x[t_0, ..., t_m] of the states xs at times ts
+        d = list(xs)
+        for m in range(1, len(ts)):
+            d = [(d[j] - d[j + 1])/(ts[j] - ts[j + m]) for j in range(len(d) - 1)]
+        return d[0]
+
+    def implicit_step(self, dt):
+        '''
+        States after a step of length dt with the current order, and dictionary with the (weighted RMS norm of the)
+        local errors of the orders which can be estimated from the history, or (None, None) if the step failed.
+        '''
+        t_1 = self.t + dt
+        ts = self.history_t[:self.order]
+        xs = self.history[:self.order]
+
+        # Derivative at t_1 of the polynomial interpolating x_1 and the previous states is a_0*x_1 + sum(a_j*x_j)
+        a_0 = sum(1/(t_1 - t_m) for t_m in ts)
+        b = np.zeros_like(self.x)
+        for j, (t_j, x_j) in enumerate(zip(ts, xs)):
+            a_j = np.prod([(t_1 - t_m)/(t_j - t_m) for m, t_m in enumerate(ts) if m != j])/(t_j - t_1)
+            b -= a_j*x_j/a_0
+
+        # Predictor by polynomial extrapolation of previous points
+        if len(self.history) == 1:
+            x_pred = self.x + self.dxdt*dt
+        else:
+            ts_pred = self.history_t[:self.order + 1]
+            x_pred = np.zeros_like(self.x)
+            for j, x_j in enumerate(self.history[:self.order + 1]):
+                x_pred += np.prod([(t_1 - t_m)/(ts_pred[j] - t_m) for m, t_m in enumerate(ts_pred) if m != j])*x_j
+
+        x_1 = self.solve_implicit(t_1, x_pred, 1/a_0, b)
+        if x_1 is None:
+            return None, None
+
+        scale = self.atol + self.rtol*np.maximum(abs(self.x), abs(x_1))
+        err = {}
+        for q in range(max(1, self.order - 1), min(self.order + 1, self.max_order) + 1):
+            if len(self.history) > q:
+                d = self.divided_difference([t_1] + self.history_t[:q + 1], [x_1] + self.history[:q + 1])
+            elif q == 1 and len(self.history) == 1:
+                # Divided difference x[t_1, t_0, t_0], with the derivative at t_0
+                d = (x_1 - self.x - self.dxdt*dt)/dt**2
+            else:
+                continue
+            err[q] = np.sqrt(np.mean((self.beta[q - 1]*factorial(q)*dt**(q + 1)*d/scale)**2))
+        return x_1, err
+
+    def step(self):
+        if self.t < self.t_end:
+            self.apply_events()
+            self.v[:] = self.g_inv(self.t, self.x)  # Network might have changed since end of last step
+            if not self.history:
+                self.history = [self.x.copy()]
+                self.history_t = [self.t]
+                self.dxdt = self.f(self.t, self.x, self.v)
+                self.order = 1
+                self.n_equal = 0
+
+            rejected = False
+            while True:
+                dt = min(self.step_size(), self.t_end - self.t)
+                x_1, err = self.implicit_step(dt)
+                if x_1 is None and dt/2 >= self.min_step:
+                    warnings.warn('Newton iteration did not converge at t={:.4f}, step size is reduced to {:.2e}.'.format(
+                        self.t + dt, dt/2))
+                    self.dt = dt/2
+                elif x_1 is None or err[self.order] <= 1 or dt <= self.min_step:
+                    break
+                else:
+                    self.dt = max(dt*max(0.2, 0.9*err[self.order]**(-1/(self.order + 1))), self.min_step)
+                self.n_rejected += 1
+                rejected = True
+
+            if x_1 is None:
+                # The history is discarded, since the states are probably not smooth here
+                x_1 = self.explicit_step(dt)
+                self.history = []
+            else:
+                self.history = ([x_1.copy()] + self.history)[:self.max_order + 2]
+                self.history_t = ([self.t + dt] + self.history_t)[:self.max_order + 2]
+                self.n_equal += 1
+
+                # Order (among the estimated ones) which allows the longest next step
+                orders = err if self.n_equal > self.order else {self.order: err[self.order]}
+                factors = {q: 0.9*err_q**(-1/(q + 1)) if err_q > 0 else np.inf for q, err_q in orders.items()}
+                order = max(factors, key=factors.get)
+                factor = min(1 if rejected else 5, max(0.2, factors[order]))
+                if order != self.order:
+                    self.order = order
+                    self.n_equal = 0
+                self.dt = min(dt*factor, self.max_step)
+
+            self.t += dt
+            self.x[:] = x_1
+            self.v[:] = self.g_inv(self.t, self.x)
+            self.n_accepted += 1
+
+        else:
+            print('End of simulation time reached.')
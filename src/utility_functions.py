@@ -1,21 +1,36 @@
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import linalg as sp_linalg
 from src.solvers import Euler, ModifiedEuler, SimpleRK4
 
 
-def newton_rhapson_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol, pf_max_it):
+def d_s_bus_d_v(y_bus, v_ph):
+    # Analytic derivatives of bus power injections S = V*conj(Y*V) with respect to voltage angles and magnitudes
+    # (polar form), returned as sparse matrices.
+    i_bus = y_bus.dot(v_ph)
+    diag_v = sp.diags(v_ph)
+    diag_i_bus = sp.diags(i_bus)
+    diag_v_norm = sp.diags(v_ph / abs(v_ph))
+
+    d_s_d_v_abs = diag_v.dot(np.conj(y_bus.dot(diag_v_norm))) + np.conj(diag_i_bus).dot(diag_v_norm)
+    d_s_d_v_angle = 1j * diag_v.dot(np.conj(diag_i_bus - y_bus.dot(diag_v)))
+
+    return d_s_d_v_angle.tocsr(), d_s_d_v_abs.tocsr()
+
+
+def newton_rhapson_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol, pf_max_it, v_init=None):
 
     n_bus = len(bus_types)
+    y_bus = sp.csr_matrix(y_bus)
 
     # Indices of PV, PQ, PV+PQ and SL-buses
     pv_idx = np.where(bus_types == 'PV')[0]
     pq_idx = np.where(bus_types == 'PQ')[0]
     pvpq_idx = np.concatenate([pv_idx, pq_idx])
 
-    n_gen_bus = len(pv_idx) + 1
-
-    # Map x to angles and voltages
-    idx_phi = range(n_bus - 1)
-    idx_v = range(n_bus - 1, n_bus - 1 + len(pq_idx))
+    # Map x to angles and voltages (angles of all non-slack buses, there might be several slack buses)
+    idx_phi = range(len(pvpq_idx))
+    idx_v = range(len(pvpq_idx), len(pvpq_idx) + len(pq_idx))
 
     def x_to_v(x):
         phi = np.zeros(n_bus)
@@ -25,14 +40,23 @@ def newton_rhapson_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol,
         v_ph = v * np.exp(1j * phi)
         return v_ph
 
-    # Initial guess: Flat start
-    phi_0 = np.zeros(n_bus)
+    # Initial guess: Flat start, or angles and PQ-bus voltages from v_init (e.g. solution at a nearby operating point)
+    phi_0 = np.zeros(n_bus) if v_init is None else np.angle(v_init)
+    v_abs_0 = v_0 if v_init is None else abs(v_init)
 
-    x0 = np.zeros(2 * (n_bus - 1) - (n_gen_bus - 1))
+    x0 = np.zeros(len(pvpq_idx) + len(pq_idx))
     x0[idx_phi] = phi_0[pvpq_idx]
-    x0[idx_v] = v_0[pq_idx]
+    x0[idx_v] = v_abs_0[pq_idx]
     x = x0.copy()
 
+    def pf_jacobian(x):
+        # Analytic jacobian of the power flow equations, assembled as a sparse matrix
+        d_s_d_v_angle, d_s_d_v_abs = d_s_bus_d_v(y_bus, x_to_v(x))
+        return sp.bmat([
+            [d_s_d_v_angle[pvpq_idx, :][:, pvpq_idx].real, d_s_d_v_abs[pvpq_idx, :][:, pq_idx].real],
+            [d_s_d_v_angle[pq_idx, :][:, pvpq_idx].imag, d_s_d_v_abs[pq_idx, :][:, pq_idx].imag],
+        ], format='csc')
+
     def pf_equations(x):
         v_ph = x_to_v(x)
         S_calc = v_ph * np.conj(y_bus.dot(v_ph))
@@ -51,11 +75,10 @@ def newton_rhapson_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol,
     while not converged and i < pf_max_it:
         i = i + 1
 
-        # Numerical jacobian
-        J = jacobian_num(pf_equations, x)
+        J = pf_jacobian(x)
 
         # Update step
-        dx = np.linalg.solve(J, err)
+        dx = sp_linalg.splu(J).solve(err)
         x -= dx
 
         err = pf_equations(x)
@@ -74,6 +97,108 @@ def newton_rhapson_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol,
     return v_sol, s_sol, converged
 
 
+def susceptance_matrix(y_bus, series='full', shunts=True):
+    # Susceptance matrix -Im(Y) of an approximated admittance matrix, as used in fast decoupled and DC power flow.
+    # The series admittance of each branch is extracted from the off-diagonal elements of y_bus, and is either
+    # kept as is (series='full') or replaced by 1/(jx), i.e. neglecting branch resistance (series='x').
+    # Bus shunts (row sums of y_bus) are included if shunts=True.
+    y_bus = sp.csr_matrix(y_bus)
+    n_bus = y_bus.shape[0]
+    y_shunt = np.asarray(y_bus.sum(axis=1)).flatten()
+
+    y_offdiag = sp.triu(y_bus, k=1) + sp.tril(y_bus, k=-1)
+    y_offdiag = y_offdiag.tocoo()
+    y_series = -y_offdiag.data
+    if series == 'x':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = (1 / y_series).imag
+            y_series = np.where(x != 0, 1 / (1j * x), y_series)
+
+    y_series = sp.csr_matrix((y_series, (y_offdiag.row, y_offdiag.col)), shape=(n_bus,) * 2)
+    y_approx = sp.diags(np.asarray(y_series.sum(axis=1)).flatten()) - y_series
+    if shunts:
+        y_approx = y_approx + sp.diags(y_shunt)
+
+    return (-y_approx.imag).tocsc()
+
+
+def fast_decoupled_power_flow(y_bus, v_0, p_sum_bus, q_sum_bus, bus_types, tol, pf_max_it, variant='XB'):
+    # Fast decoupled power flow. B' and B'' are factorized once and the factors are reused in all iterations.
+    y_bus = sp.csr_matrix(y_bus)
+
+    pv_idx = np.where(bus_types == 'PV')[0]
+    pq_idx = np.where(bus_types == 'PQ')[0]
+    pvpq_idx = np.concatenate([pv_idx, pq_idx])
+
+    if variant == 'XB':
+        b_p = susceptance_matrix(y_bus, series='x', shunts=False)
+        b_pp = susceptance_matrix(y_bus, series='full', shunts=True)
+    elif variant == 'BX':
+        b_p = susceptance_matrix(y_bus, series='full', shunts=False)
+        b_pp = susceptance_matrix(y_bus, series='x', shunts=True)
+    else:
+        raise ValueError('Unknown fast decoupled power flow variant: {}'.format(variant))
+
+    b_p_lu = sp_linalg.splu(b_p[pvpq_idx, :][:, pvpq_idx].tocsc())
+    b_pp_lu = sp_linalg.splu(b_pp[pq_idx, :][:, pq_idx].tocsc()) if len(pq_idx) > 0 else None
+
+    # Flat start
+    phi = np.zeros(len(bus_types))
+    v_abs = v_0.copy()
+
+    def pf_equations(phi, v_abs):
+        v_ph = v_abs * np.exp(1j * phi)
+        S_calc = v_ph * np.conj(y_bus.dot(v_ph))
+        return p_sum_bus + S_calc.real, q_sum_bus + S_calc.imag
+
+    converged = False
+    i = 0
+    while not converged and i < pf_max_it:
+        i = i + 1
+
+        # P-theta half iteration
+        p_err, q_err = pf_equations(phi, v_abs)
+        phi[pvpq_idx] -= b_p_lu.solve(p_err[pvpq_idx] / v_abs[pvpq_idx])
+
+        # Q-V half iteration
+        p_err, q_err = pf_equations(phi, v_abs)
+        if b_pp_lu is not None:
+            v_abs[pq_idx] -= b_pp_lu.solve(q_err[pq_idx] / v_abs[pq_idx])
+
+        p_err, q_err = pf_equations(phi, v_abs)
+        err_norm = max(abs(np.concatenate([p_err[pvpq_idx], q_err[pq_idx]])))
+        if tol > err_norm:
+            converged = True
+
+    if not converged:
+        print('Warning: Power flow did not converge in {} iterations.'.format(pf_max_it))
+
+    v_sol = v_abs * np.exp(1j * phi)
+    s_sol = v_sol * np.conj(y_bus.dot(v_sol))
+
+    return v_sol, s_sol, converged
+
+
+def dc_power_flow(y_bus, v_0, p_sum_bus, bus_types):
+    # DC power flow: Lossless network, voltage magnitudes at setpoint (PV-buses) or 1 (PQ-buses), and angles from a
+    # single solve with the (factorized) susceptance matrix.
+    y_bus = sp.csr_matrix(y_bus)
+
+    pv_idx = np.where(bus_types == 'PV')[0]
+    pq_idx = np.where(bus_types == 'PQ')[0]
+    pvpq_idx = np.concatenate([pv_idx, pq_idx])
+
+    b = susceptance_matrix(y_bus, series='x', shunts=False)
+
+    phi = np.zeros(len(bus_types))
+    phi[pvpq_idx] = sp_linalg.splu(b[pvpq_idx, :][:, pvpq_idx].tocsc()).solve(-p_sum_bus[pvpq_idx])
+
+    v_sol = v_0 * np.exp(1j * phi)
+    s_sol = v_sol * np.conj(y_bus.dot(v_sol))
+
+    return v_sol, s_sol, True
+
+
 def remove_recarray_field(a, field):
     names = []
     col_dtypes = []
@@ -200,6 +325,51 @@ def jacobian_num(f, x, eps=1e-10, **params):
     return J
 
 
+def color_columns(sparsity):
+    # Greedy (largest first) column coloring of a sparsity pattern (Curtis-Powell-Reid): Columns without common
+    # nonzero rows get the same color, and can be perturbed simultaneously when computing the Jacobian.
+    sparsity = sp.csc_matrix(sparsity, dtype=bool)
+    sparsity_rows = sparsity.tocsr()
+    n_cols = sparsity.shape[1]
+    colors = -np.ones(n_cols, dtype=int)
+    for j in np.argsort(-np.diff(sparsity.indptr), kind='stable'):
+        rows = sparsity.indices[sparsity.indptr[j]:sparsity.indptr[j + 1]]
+        neighbours = np.unique(np.concatenate([np.zeros(0, dtype=int)] + [
+            sparsity_rows.indices[sparsity_rows.indptr[i]:sparsity_rows.indptr[i + 1]] for i in rows
+        ]))
+        used = np.zeros(n_cols + 1, dtype=bool)
+        used[colors[neighbours][colors[neighbours] >= 0]] = True
+        colors[j] = np.argmin(used)
+    return colors
+
+
+def jacobian_num_sparse(f, x, sparsity, eps=1e-10, colors=None, **params):
+    # Numerical computation of Jacobian with known sparsity pattern. All columns of the same color (see
+    # color_columns) are perturbed in the same function evaluation, and the Jacobian is returned as a sparse matrix.
+    sparsity = sp.csc_matrix(sparsity, dtype=bool)
+    if colors is None:
+        colors = color_columns(sparsity)
+
+    rows = sparsity.indices
+    cols = np.repeat(np.arange(sparsity.shape[1]), np.diff(sparsity.indptr))
+    data = np.zeros(len(rows))
+    for color in range(colors.max() + 1 if len(colors) > 0 else 0):
+        mask = colors == color
+        x1 = x.copy()
+        x2 = x.copy()
+
+        x1[mask] += eps
+        x2[mask] -= eps
+
+        f1 = f(x1, **params)
+        f2 = f(x2, **params)
+
+        entries = mask[cols]
+        data[entries] = ((f1 - f2) / (2 * eps))[rows[entries]]
+
+    return sp.csc_matrix((data, (rows, cols)), shape=sparsity.shape)
+
+
 class DynamicModel:  # This is not used anymore?
     # Empty dummy-class for dynamic models (Gen, AVR, GOV, PSS etc.)
     def __init__(self):
@@ -0,0 +1,55 @@
+import importlib
+import numpy as np
+import pytest
+import src.dynamic as dps
+from src.dyn_models.utils import BlockGroup
+
+
+def load_dynamic_load_model():
+    # k2a with filtered dynamic loads, whose filters are merged with the time constants of the governors
+    model = importlib.import_module('casestudies.ps_data.k2a').load()
+    model['loads'] = {'DynamicLoadFiltered': [
+        ['name',    'bus',  'P',    'Q',    'T_g',  'T_b'],
+        ['L1',      'B7',   967,    100,    0.1,    0.2],
+        ['L2',      'B9',   1767,   100,    0.1,    0.2],
+    ]}
+    return model
+
+
+@pytest.mark.parametrize('load_model', [
+    importlib.import_module('casestudies.ps_data.k2a').load,
+    importlib.import_module('casestudies.ps_data.ieee39').load,
+    importlib.import_module('casestudies.ps_data.k2a_GFM_A1').load,
+    load_dynamic_load_model,
+])
+def test_compiled_state_derivatives(load_model):
+    # The compiled evaluation schedule and the merged blocks must give the same state derivatives as the lazy
+    # evaluation of the models one by one
+    ps = dps.PowerSystemModel(load_model())
+    ps.init_dyn_sim()
+    ps_ref = dps.PowerSystemModel(load_model())
+    ps_ref.batch_blocks = False
+    ps_ref.init_dyn_sim()
+    ps_ref.evaluation_schedule = None
+
+    groups = [mdl for mdl in ps.state_derivative_mdls if isinstance(mdl, BlockGroup)]
+    assert len(groups) > 0
+    assert not any(isinstance(mdl, BlockGroup) for mdl in ps_ref.state_derivative_mdls)
+
+    rng = np.random.default_rng(0)
+    x = ps.x_0 + 1e-2*rng.normal(size=ps.n_states)
+    v = ps.solve_algebraic(0, x)
+    dx = ps.state_derivatives(0, x, v)
+    assert np.array_equal(dx, ps_ref.state_derivatives(0, x, v))
+
+    # Parameters changed after compile() (of the first block of each group, in both models). Integer parameters are
+    # not changed, since they are stored as floats in the merged parameters.
+    for group in groups:
+        i = next(i for i, mdl in enumerate(ps.dyn_mdls) if mdl is group.blocks[0])
+        for field in ps_ref.dyn_mdls[i].par.dtype.names:
+            if ps_ref.dyn_mdls[i].par[field].dtype == float:
+                ps.dyn_mdls[i].par[field] *= 1.5
+                ps_ref.dyn_mdls[i].par[field] *= 1.5
+    dx_changed = ps.state_derivatives(0, x, v)
+    assert not np.array_equal(dx_changed, dx)
+    assert np.array_equal(dx_changed, ps_ref.state_derivatives(0, x, v))
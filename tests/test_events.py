@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+import casestudies.ps_data.k2a as model_data
+import src.dynamic as dps
+import src.utility_functions as dps_uf
+from src.events import EventQueue
+
+
+def init_kron_reduced():
+    ps = dps.PowerSystemModel(model_data.load())
+    ps.perform_kron_reduction = True
+    ps.init_dyn_sim()
+    return ps
+
+
+@pytest.mark.parametrize('bus_name', ['B5', 'B99'])
+def test_fault_on_bus_outside_reduced_system(bus_name):
+    # B5 is removed by Kron reduction, B99 does not exist
+    ps = init_kron_reduced()
+    events = EventQueue(ps, [(0, 'fault', bus_name, 1e6)])
+    with pytest.raises(ValueError, match=bus_name):
+        events.apply(0)
+
+
+@pytest.mark.parametrize('line_name', ['L7-8-1', 'L99'])
+def test_line_event_outside_reduced_system(line_name):
+    # B8 is removed by Kron reduction, L99 does not exist. The line status must not be changed.
+    ps = init_kron_reduced()
+    events = EventQueue(ps, [(0, 'line', line_name, 'disconnect')])
+    with pytest.raises(ValueError, match=line_name):
+        events.apply(0)
+    assert np.all(ps.lines['Line'].connected)
+
+
+def test_line_event():
+    ps = dps.PowerSystemModel(model_data.load())
+    ps.init_dyn_sim()
+    y_bus_red = ps.y_bus_red.copy()
+    events = EventQueue(ps, [(0, 'line', 'L7-8-1', 'disconnect'), (1, 'line', 'L7-8-1', 'connect')])
+    events.apply(0)
+    assert not ps.lines['Line'].connected[2]
+    assert abs(ps.y_bus_red - y_bus_red).max() > 0
+    events.apply(1)
+    assert ps.lines['Line'].connected[2]
+    assert np.allclose(ps.y_bus_red.toarray(), y_bus_red.toarray())
+
+
+def test_fault_on_bus_in_reduced_system():
+    ps = init_kron_reduced()
+    events = EventQueue(ps, [(0, 'fault', 'B7', 1e6)])
+    events.apply(0)
+    bus_idx_red = np.searchsorted(ps.bus_idx_red, dps_uf.lookup_strings('B7', ps.buses['name']))
+    assert ps.y_bus_red_mod[bus_idx_red, bus_idx_red] == 1e6
+
+
+def test_load_event_unknown_load():
+    ps = init_kron_reduced()
+    events = EventQueue(ps, [(0, 'load', 'L99', (100, 0))])
+    with pytest.raises(ValueError, match='L99'):
+        events.apply(0)
@@ -0,0 +1,231 @@
+import numpy as np
+import scipy.signal
+import casestudies.ps_data.k2a as model_data
+import casestudies.ps_data.ieee39 as model_data_ieee39
+import src.dynamic as dps
+import src.modal_analysis as dps_mdlan
+
+
+def set_inertia(ps, value):
+    ps.gen['GEN'].par['H'] = value
+
+
+def init_model(model):
+    ps = dps.PowerSystemModel(model)
+    ps.init_dyn_sim()
+    return ps
+
+
+def init_input_output_model():
+    # Linearized k2a with the auxiliary voltage of each generator as input and its speed as output
+    ps = init_model(model_data.load())
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(ps)
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+    gen = ps.gen['GEN']
+    ps_lin.linearize_inputs_v4([(('gen', 'GEN'), 'v_aux', name) for name in gen.par['name']])
+    ps_lin.c = np.zeros((gen.n_units, ps_lin.n))
+    ps_lin.c[np.arange(gen.n_units), gen.state_idx_global['speed']] = 1
+    return ps_lin
+
+
+def test_linearize_other_model():
+    # The sparsity pattern found for the first model must not be reused for the second
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(init_model(model_data.load()))
+    ps_lin.linearize()
+    ps = init_model(model_data_ieee39.load())
+    ps_lin.linearize(ps=ps)
+
+    ps_lin_ref = dps_mdlan.PowerSystemModelLinearization(ps)
+    ps_lin_ref.linearize()
+    assert ps_lin.n == ps.n_states
+    assert np.allclose(ps_lin.a, ps_lin_ref.a)
+
+
+def test_eigs_descriptor_repeated_modes():
+    # n44 has identical generators, giving repeated modes (e.g. six at -1.75 +/- 8.71j)
+    import casestudies.ps_data.n44 as model_data_n44
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(init_model(model_data_n44.load()))
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+    pf_dense = ps_lin.rev*ps_lin.lev.T
+
+    eigs, rev, lev = ps_lin.eigs_descriptor(-1.7 + 8.7j, k=12, left=True)
+    assert np.allclose(lev.dot(rev), np.eye(len(eigs)), atol=1e-8)
+    assert np.allclose(lev.dot(ps_lin.a), eigs[:, None]*lev, atol=1e-8)
+
+    # The participation factors of the individual modes in a cluster depend on the chosen eigenvectors, but their sum
+    # does not (compared for clusters found completely)
+    pf = rev*lev.T
+    compared = np.zeros(len(eigs), dtype=bool)
+    for eig in eigs:
+        cluster = abs(eigs - eig) < 1e-6*abs(eig)
+        cluster_dense = abs(ps_lin.eigs - eig) < 1e-6*abs(eig)
+        if sum(cluster) == sum(cluster_dense):
+            assert np.allclose(pf[:, cluster].sum(axis=1), pf_dense[:, cluster_dense].sum(axis=1), atol=1e-8)
+            compared |= cluster
+    assert sum(compared) >= 6
+
+
+def test_eigenvalue_decomposition_sparse():
+    # All modes in the requested region must be found, also the well damped ones far from the imaginary axis (ieee39
+    # has modes with damping 0.97 at real part -25)
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(init_model(model_data_ieee39.load()))
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+    mode_idx = ps_lin.get_mode_idx()
+    eigs_dense = ps_lin.eigs[mode_idx]
+    pf_dense = (ps_lin.rev*ps_lin.lev.T)[:, mode_idx]
+    assert len(eigs_dense) == 24
+
+    ps_lin.eigenvalue_decomposition_sparse()
+    assert len(ps_lin.eigs) == len(eigs_dense)
+    for eig, pf in zip(eigs_dense, pf_dense.T):
+        i = np.argmin(abs(ps_lin.eigs - eig))
+        assert abs(ps_lin.eigs[i] - eig) < 1e-8
+        assert np.allclose(ps_lin.rev[:, i]*ps_lin.lev[i], pf, atol=1e-8)
+
+
+def test_linearize_inputs_batched():
+    ps = init_model(model_data.load())
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(ps)
+    ps_lin.linearize()
+    input_description = [(('gen', 'GEN'), 'P_m', name) for name in ps.gen['GEN'].par['name']]
+    b = ps_lin.linearize_inputs_v4(input_description, batched=False)
+
+    # The derivatives with respect to the states are not needed for the input matrix
+    def sparse_jacobians(*args):
+        raise AssertionError('sparse_jacobians should not be called')
+    ps_lin.sparse_jacobians = sparse_jacobians
+    assert np.allclose(ps_lin.linearize_inputs_v4(input_description, batched=True), b, atol=1e-6)
+
+
+def test_linearize_outputs_vector_valued():
+    # Outputs returning arrays give one row for each element
+    ps = init_model(model_data.load())
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(ps)
+    gen = ps.gen['GEN']
+    c = ps_lin.linearize_outputs_v4([
+        lambda t, x, v: gen.speed(x, v),
+        lambda t, x, v: abs(v[0]),
+    ])
+    assert c.shape == (gen.n_units + 1, ps.n_states)
+    c_speed = ps_lin.linearize_outputs_v4([lambda t, x, v, i=i: gen.speed(x, v)[i] for i in range(gen.n_units)])
+    assert np.allclose(c[:gen.n_units], c_speed)
+    assert np.allclose(c[gen.n_units], ps_lin.linearize_outputs_v4([lambda t, x, v: abs(v[0])])[0])
+    assert np.allclose(c[np.arange(gen.n_units), gen.state_idx_global['speed']], 1)
+
+
+def test_parameter_sweep_kron_reduction():
+    # With sparse Kron reduction, red_to_full is a LinearOperator, which is recomputed by the workers
+    options = {'perform_kron_reduction': True, 'sparse_y_bus': True}
+    values = np.linspace(4, 8, 4)
+    eigs = dps_mdlan.ParameterSweep(model_data.load(), set_inertia, values, max_workers=2, options=options).run()
+    eigs_ref = dps_mdlan.ParameterSweep(model_data.load(), set_inertia, values, max_workers=1, options=options).run()
+    # Compared at each point (the modes can be paired differently at the boundary between the chunks)
+    assert np.allclose(np.sort_complex(eigs), np.sort_complex(eigs_ref), equal_nan=True)
+    assert not np.allclose(np.sort_complex(eigs[0]), np.sort_complex(eigs[-1]), equal_nan=True)
+
+
+def test_eigenvalue_sensitivity():
+    # Compared with central differences of the eigenvalues of the linearized model. The PSS gains are given as floats,
+    # since integer parameters are rounded when perturbed.
+    model = model_data.load()
+    for row in model['pss']['STAB1'][1:]:
+        row[2] = float(row[2])
+    ps = init_model(model)
+    pss = ps.pss['STAB1']
+    assert pss.lead_lag_1.par.base is not None  # Parameters of merged blocks are views (see BlockGroup)
+
+    ps_lin = dps_mdlan.PowerSystemModelLinearization(ps)
+    ps_lin.linearize()
+    ps_lin.eigenvalue_decomposition()
+    freq = ps_lin.eigs.imag/(2*np.pi)
+    mode_idx = np.where((freq > 0.2) & (freq < 2))[0]  # Electromechanical modes
+    assert len(mode_idx) == 5
+
+    parameters = [
+        (ps.gen['GEN'], (('gen', 'GEN'), 'H')),
+        (pss.gain, (('pss', 'STAB1'), 'gain.K')),
+        (pss.lead_lag_1, (('pss', 'STAB1'), 'lead_lag_1.T_1')),
+    ]
+    sensitivity = ps_lin.eigenvalue_sensitivity([description for _, description in parameters], mode_idx=mode_idx)
+    for k, (mdl, (_, par_name)) in enumerate(parameters):
+        par_name = par_name.split('.')[-1]
+        par_0 = mdl.par[par_name].copy()
+        delta = 1e-3*max(np.max(abs(par_0)), 1)
+        eigs = []
+        for sign in [1, -1]:
+            mdl.par[par_name] = par_0 + sign*delta
+            ps_lin_perturbed = dps_mdlan.PowerSystemModelLinearization(ps)
+            ps_lin_perturbed.linearize()
+            ps_lin_perturbed.eigenvalue_decomposition()
+            eigs.append([ps_lin_perturbed.eigs[np.argmin(abs(ps_lin_perturbed.eigs - eig))]
+                         for eig in ps_lin.eigs[mode_idx]])
+        mdl.par[par_name] = par_0
+        sensitivity_ref = (np.array(eigs[0]) - np.array(eigs[1]))/(2*delta)
+        assert np.allclose(sensitivity[:, k], sensitivity_ref, rtol=0, atol=5e-6)
+
+
+def test_frequency_response():
+    ps_lin = init_input_output_model()
+    omega = 2*np.pi*np.logspace(-2, 1, 50)
+    g = ps_lin.frequency_response(omega)
+    g_ref = np.array([ps_lin.c.dot(np.linalg.solve(1j*w*np.eye(ps_lin.n) - ps_lin.a, ps_lin.b)) for w in omega])
+    assert g.shape == (len(omega), 4, 4)
+    assert np.allclose(g, g_ref, rtol=0, atol=1e-9*abs(g_ref).max())
+    # Evaluated in chunks of frequencies
+    assert np.allclose(ps_lin.frequency_response(omega, max_elements=100), g, rtol=0, atol=1e-12*abs(g).max())
+
+
+def test_simulate():
+    # Compared with stepping the system discretized by scipy (zero-order hold), for a batch of input profiles and
+    # initial states
+    ps_lin = init_input_output_model()
+    t = np.arange(0, 5, 1e-2)
+    rng = np.random.default_rng(0)
+    u = 1e-2*rng.normal(size=(3, len(t), 4))
+    x_0 = 1e-3*rng.normal(size=(3, ps_lin.n))
+
+    a_d, b_d, *_ = scipy.signal.cont2discrete((ps_lin.a, ps_lin.b, ps_lin.c, np.zeros((4, 4))), t[1] - t[0], 'zoh')
+    x_ref = np.zeros((3, len(t), ps_lin.n))
+    x_ref[:, 0] = x_0
+    for k in range(len(t) - 1):
+        x_ref[:, k + 1] = x_ref[:, k].dot(a_d.T) + u[:, k].dot(b_d.T)
+    y_ref = x_ref.dot(ps_lin.c.T)
+
+    for method in ['modal', 'expm']:
+        res = ps_lin.simulate(t, u, x_0, method=method)
+        assert res['x'].shape == x_ref.shape and res['x'].dtype == float
+        assert np.allclose(res['x'], x_ref, rtol=0, atol=1e-10*abs(x_ref).max())
+        assert np.allclose(res['y'], y_ref, rtol=0, atol=1e-10*abs(y_ref).max())
+
+        res = ps_lin.simulate(t, u[1], x_0[1], method=method, return_states=False, max_elements=1000)
+        assert 'x' not in res
+        assert np.allclose(res['y'], y_ref[1], rtol=0, atol=1e-10*abs(y_ref).max())
+
+
+def test_modal_truncation():
+    ps_lin = init_input_output_model()
+    mode_idx = ps_lin.get_mode_idx(['em', 'non_conj'], damp_threshold=0.3)
+    reduced = ps_lin.modal_truncation(mode_idx)
+    reduced.eigenvalue_decomposition()
+    eigs = np.concatenate([ps_lin.eigs[mode_idx], ps_lin.eigs[mode_idx].conj()])
+    assert reduced.n == 2*len(mode_idx)
+    assert np.isrealobj(reduced.a)
+    assert np.allclose(np.sort_complex(reduced.eigs), np.sort_complex(eigs), rtol=0, atol=1e-10)
+
+
+def test_balanced_truncation():
+    # The error of the frequency response is bounded by twice the sum of the truncated Hankel singular values, and the
+    # modes that are not stable (the zero eigenvalue of the rotor angles) are kept in addition to the balanced states
+    ps_lin = init_input_output_model()
+    omega = 2*np.pi*np.logspace(-2, 1, 200)
+    g = ps_lin.frequency_response(omega)
+    n_unstable = np.sum(ps_lin.eigs.real >= -1e-6)
+    assert n_unstable == 1
+    for order in [4, 10, 20]:
+        reduced = ps_lin.balanced_truncation(order=order)
+        assert reduced.n == order + n_unstable
+        err = max(np.linalg.norm(g_k, 2) for g_k in g - reduced.frequency_response(omega))
+        assert err <= 2*np.sum(reduced.hsv[order:])
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import numpy as np
+import casestudies.ps_data.k2a as model_data
+from src.scenarios import MultiScenarioModel, run_contingencies
+
+
+def test_multi_scenario_snapshot():
+    ps = MultiScenarioModel(model_data.load(), 3)
+    ps.init_dyn_sim()
+    with tempfile.TemporaryDirectory() as folder:
+        file_path = os.path.join(folder, 'snapshot.pkl')
+        ps.save_snapshot(file_path)
+        ps_loaded = MultiScenarioModel.load_snapshot(file_path)
+
+    assert ps_loaded.n_scenarios == 3
+    assert np.array_equal(ps_loaded.x_0, ps.x_0)
+    assert np.array_equal(ps_loaded.scenario_state_idx, ps.scenario_state_idx)
+    assert np.allclose(ps_loaded.state_derivatives(0, ps.x_0, ps.v_0), ps.state_derivatives(0, ps.x_0, ps.v_0))
+
+
+def test_contingencies_start_from_same_state():
+    # Identical scenarios must give identical results, regardless of the worker that runs them (the initialization
+    # of the governors of k2a_regulated is not deterministic)
+    import casestudies.ps_data.k2a_regulated as model_data_regulated
+    scenarios = [[(0.1, 'fault', 'B1', 1e6), (0.15, 'fault', 'B1', 0)]]*4
+    results = dict(run_contingencies(model_data_regulated.load(), scenarios, t_end=0.3, max_step=5e-3, max_workers=2))
+    assert len(results) == 4
+    for res in results.values():
+        assert np.array_equal(res['x'], results[0]['x'])
+
+
+def test_contingencies_kron_reduction():
+    # With sparse Kron reduction, red_to_full is a LinearOperator, which is recomputed by the workers
+    scenarios = [[(0.1, 'fault', 'B1', 1e6), (0.15, 'fault', 'B1', 0)]]*2
+    options = {'perform_kron_reduction': True, 'sparse_y_bus': True}
+    results = dict(run_contingencies(model_data.load(), scenarios, t_end=0.3, max_step=5e-3, max_workers=2,
+                                     options=options))
+    assert np.array_equal(results[0]['x'], results[1]['x'])
@@ -0,0 +1,71 @@
+import importlib
+import warnings
+import numpy as np
+import src.dynamic as dps
+import src.solvers as dps_sol
+from src.events import EventQueue
+
+
+def simulate_fault(solver, dt, t_end, model='k2a_GFL_A1', **kwargs):
+    ps = dps.PowerSystemModel(importlib.import_module('casestudies.ps_data.' + model).load())
+    ps.init_dyn_sim()
+    bus_name = ps.gen['GEN'].par['bus'][0]
+    events = EventQueue(ps, [(1, 'fault', bus_name, 1e6), (1.1, 'fault', bus_name, 0)])
+    sol = solver(ps.state_derivatives, ps.solve_algebraic, 0, ps.x_0.copy(), t_end, max_step=dt, events=events,
+                 **kwargs)
+    while sol.t < t_end - 1e-9:
+        sol.step()
+    return sol
+
+
+def test_implicit_solvers_do_not_accept_unconverged_steps():
+    x_ref = simulate_fault(dps_sol.TrapezoidalDAE, 1e-3, 3).x
+    for solver in [dps_sol.TrapezoidalDAE, dps_sol.BDFDAE]:
+        converged = []
+        solve_implicit = solver.solve_implicit
+
+        def solve_implicit_checked(self, t, x_pred, c, b):
+            x = solve_implicit(self, t, x_pred, c, b)
+            if x is not None:
+                r = x - c*self.f_ode(t, x) - b
+                converged.append(np.max(abs(r)/(1 + abs(x))) < 1e-4)
+            return x
+
+        solver.solve_implicit = solve_implicit_checked
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                sol = simulate_fault(solver, 5e-2, 3)
+        finally:
+            solver.solve_implicit = solve_implicit
+
+        assert all(converged)
+        assert sol.n_rejected > 0
+        assert abs(sol.x - x_ref).max() < 0.2
+
+
+def test_bdf_variable_order():
+    x_ref = simulate_fault(dps_sol.TrapezoidalDAE, 1e-3, 3).x
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        sol = simulate_fault(dps_sol.BDFDAE, 5e-2, 3)
+    assert abs(sol.x - x_ref).max() < 0.01
+    assert sol.n_accepted < 200
+    assert sol.order > 2
+    assert len(sol.history) == sol.max_order + 2
+
+
+def test_bdf_max_order():
+    orders = []
+    implicit_step = dps_sol.BDFDAE.implicit_step
+
+    def implicit_step_logged(self, dt):
+        orders.append(self.order)
+        return implicit_step(self, dt)
+
+    dps_sol.BDFDAE.implicit_step = implicit_step_logged
+    try:
+        simulate_fault(dps_sol.BDFDAE, 1e-2, 2, model='k2a', max_order=2)
+    finally:
+        dps_sol.BDFDAE.implicit_step = implicit_step
+    assert max(orders) == 2